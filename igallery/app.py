@@ -1,55 +1,144 @@
 """Flask web application for iGallery."""
 
-import io
+import atexit
 import os
+import queue
+import stat
 import time as _time
 import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
-from flask import Flask, render_template, send_file, request, jsonify, abort, make_response
+from flask import Flask, render_template, send_from_directory, request, jsonify, abort, make_response
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
 
 from igallery.database import Database
 from igallery.thumbnail_service import ThumbnailService
-from igallery.file_operations import FileOperations
+from igallery.file_operations import FileOperations, _RACY_MTIME_NS, move_file
 
 
-def _collect_all_image_paths_in_dir(directory: Path, exclude_dirs: set[str] = None) -> set[str]:
+def _collect_all_image_paths_in_dir(
+    directory: Path,
+    exclude_dirs: set[str] = None,
+    db: Database = None,
+) -> set[str]:
     """Recursively collect all image paths in a directory.
 
+    When a database is given, its directory index is used to skip listing
+    directories whose mtime is unchanged since the last scan.  The index
+    only stores each directory's mtime: an unchanged directory's images are
+    the paths the database already tracks directly in it, and its
+    subdirectories are its indexed children.  Only changed directories are
+    re-listed, and the index is updated afterwards.  With a database, the
+    result is therefore exactly what orphan cleanup needs: every tracked
+    path that still exists, plus everything in changed directories.
+
+    Directories modified within _RACY_MTIME_NS of the scan, and directories
+    holding symlinked images (tracked under their target paths), are always
+    re-listed: they are indexed with Database.UNTRUSTED_MTIME_NS.
+
     Args:
         directory: Directory to scan
         exclude_dirs: Set of directory names to exclude
+        db: Database holding the directory index (optional)
 
     Returns:
         Set of absolute image paths
     """
     exclude_dirs = exclude_dirs or set()
     images = set()
+    updated = []
+    removed = []
+    known = []
+
+    # Iterative scandir walk: DirEntry type checks reuse the dirent d_type,
+    # so regular files cost no extra stat() and no Path allocation.
+    # Symlinked dirs are never descended, so every path under the resolved
+    # root is already canonical; only symlinked files need realpath().
+    stack = [os.path.realpath(directory)]
+    while stack:
+        dir_path = stack.pop()
+
+        if db is not None:
+            # Stat before listing: a change racing the scan leaves an older
+            # mtime in the index, which forces a rescan next time
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+            racy = _time.time_ns() - mtime_ns < _RACY_MTIME_NS
+            cached = db.get_directory_index_entry(dir_path)
+            if cached is not None and cached[0] == mtime_ns and not racy:
+                images.update(db.get_tracked_paths_in_dir(dir_path))
+                stack.extend(os.path.join(dir_path, d) for d in cached[1] if d not in exclude_dirs)
+                continue
+
+        subdirs = []
+        dir_images = []
+        has_symlinks = False
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        # Like os.walk, don't descend into symlinked dirs
+                        if not entry.is_symlink():
+                            subdirs.append(entry.name)
+                    elif ThumbnailService.is_image_file(entry.name):
+                        if entry.is_symlink():
+                            has_symlinks = True
+                            dir_images.append(os.path.realpath(entry.path))
+                        else:
+                            dir_images.append(entry.path)
+        except OSError:
+            continue
 
-    for root, dirs, files in os.walk(directory):
-        # Filter out excluded directories
-        dirs[:] = [d for d in dirs if d not in exclude_dirs]
+        images.update(dir_images)
+        stack.extend(os.path.join(dir_path, d) for d in subdirs if d not in exclude_dirs)
 
-        for file in files:
-            file_path = Path(root) / file
-            if ThumbnailService.is_image_file(str(file_path)):
-                images.add(str(file_path.resolve()))
+        if db is not None:
+            trusted = not (racy or has_symlinks)
+            updated.append((dir_path, mtime_ns if trusted else Database.UNTRUSTED_MTIME_NS))
+            # Excluded subdirs are indexed too, so a later scan without the
+            # exclusion still finds them under an unchanged parent
+            known.extend(os.path.join(dir_path, d) for d in subdirs)
+            if cached is not None:
+                removed.extend(os.path.join(dir_path, d) for d in set(cached[1]) - set(subdirs))
+
+    if updated or removed:
+        db.update_directory_index(updated, removed, known)
 
     return images
 
 
+def _stat_etag(stat_result: os.stat_result) -> str:
+    """Build an ETag value from a file's mtime and size.
+
+    Args:
+        stat_result: Result of os.stat on the source image
+
+    Returns:
+        ETag value (unquoted)
+    """
+    return f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+
+
 class _DirectoryImageCache:
     """Caches recursive image listings, validated by directory mtimes.
 
     On cache hit, stats only the directories (not individual files) to check
     for changes.  A short debounce window coalesces rapid-fire requests
     (e.g. carousel current + preload) without any stat calls at all.
+    Listings not requested for max_idle_seconds are dropped whenever a new
+    walk is stored, so browsing many folders doesn't grow the cache forever.
     """
 
-    def __init__(self, debounce_seconds: float = 1.0):
+    def __init__(self, debounce_seconds: float = 1.0, max_idle_seconds: float = 300.0):
         self._cache: dict[tuple, dict] = {}
         self._lock = threading.Lock()
         self._debounce = debounce_seconds
+        self._max_idle = max_idle_seconds
         self._generation: int = 0
         # Tracks the most recent time remove_image/move_image mutated the cache.
         # Used to detect when a concurrent mutation occurred during a walk so the
@@ -68,7 +157,8 @@ class _DirectoryImageCache:
         when the image list has changed and avoid redundant work.
         """
         exclude_dirs = exclude_dirs or set()
-        key = (str(directory.resolve()), frozenset(exclude_dirs))
+        root = str(directory.resolve())
+        key = (root, frozenset(exclude_dirs))
         now = _time.monotonic()
 
         with self._lock:
@@ -86,7 +176,7 @@ class _DirectoryImageCache:
         # Cache miss or stale — walk outside the lock.
         # Record the time before walking so we can detect concurrent mutations.
         walk_start = _time.monotonic()
-        images, dir_mtimes = self._walk(directory, exclude_dirs)
+        images, dir_mtimes = self._walk(root, exclude_dirs)
 
         with self._lock:
             self._generation += 1
@@ -102,10 +192,17 @@ class _DirectoryImageCache:
             if existing is not None and self._last_mutation_at >= walk_start:
                 images = images & existing['images']
 
+            stored_at = _time.monotonic()
+            # checked_at is refreshed at least once per debounce window while
+            # an entry is in use, so it doubles as a last-used time
+            for stale_key in [k for k, e in self._cache.items()
+                              if stored_at - e['checked_at'] > self._max_idle]:
+                del self._cache[stale_key]
+
             self._cache[key] = {
                 'images': images,
                 'dir_mtimes': dir_mtimes,
-                'checked_at': _time.monotonic(),
+                'checked_at': stored_at,
                 'generation': gen,
             }
 
@@ -118,7 +215,7 @@ class _DirectoryImageCache:
         next mtime validation won't see a stale directory and re-walk.
         """
         resolved = str(Path(image_path).resolve())
-        parent = str(Path(image_path).resolve().parent)
+        parent = os.path.dirname(resolved)
 
         with self._lock:
             self._last_mutation_at = _time.monotonic()
@@ -131,6 +228,25 @@ class _DirectoryImageCache:
                         except OSError:
                             pass
 
+    def add_image(self, image_path: str):
+        """Patch the cache after a file reappears (e.g. restore from trash).
+
+        Only entries that already track the file's parent directory are
+        updated; anything else is caught by the next mtime validation.
+        """
+        resolved = str(Path(image_path).resolve())
+        parent = os.path.dirname(resolved)
+
+        with self._lock:
+            self._last_mutation_at = _time.monotonic()
+            for entry in self._cache.values():
+                if parent in entry['dir_mtimes']:
+                    entry['images'].add(resolved)
+                    try:
+                        entry['dir_mtimes'][parent] = os.stat(parent).st_mtime
+                    except OSError:
+                        pass
+
     def move_image(self, old_path: str, new_path: str):
         """Patch the cache after moving a file (e.g. move-up).
 
@@ -139,8 +255,8 @@ class _DirectoryImageCache:
         """
         old_resolved = str(Path(old_path).resolve())
         new_resolved = str(Path(new_path).resolve())
-        old_parent = str(Path(old_resolved).parent)
-        new_parent = str(Path(new_resolved).parent)
+        old_parent = os.path.dirname(old_resolved)
+        new_parent = os.path.dirname(new_resolved)
 
         with self._lock:
             self._last_mutation_at = _time.monotonic()
@@ -166,21 +282,212 @@ class _DirectoryImageCache:
         return True
 
     @staticmethod
-    def _walk(directory: Path, exclude_dirs: set[str]) -> tuple[set[str], dict[str, float]]:
+    def _walk(root: str, exclude_dirs: set[str]) -> tuple[set[str], dict[str, float]]:
+        images: set[str] = set()
+        dir_mtimes: dict[str, float] = {}
+        subdirs = _DirectoryImageCache._scan_dir(root, exclude_dirs, images, dir_mtimes)
+
+        # Fan top-level subtrees out to the scan pool: scandir and stat release
+        # the GIL, so independent subtrees are listed concurrently
+        if len(subdirs) > 1:
+            for sub_images, sub_mtimes in _get_scan_pool().map(
+                lambda d: _DirectoryImageCache._walk_subtree(d, exclude_dirs), subdirs
+            ):
+                images |= sub_images
+                dir_mtimes.update(sub_mtimes)
+        elif subdirs:
+            sub_images, sub_mtimes = _DirectoryImageCache._walk_subtree(subdirs[0], exclude_dirs)
+            images |= sub_images
+            dir_mtimes.update(sub_mtimes)
+
+        return images, dir_mtimes
+
+    @staticmethod
+    def _walk_subtree(root: str, exclude_dirs: set[str]) -> tuple[set[str], dict[str, float]]:
         images: set[str] = set()
         dir_mtimes: dict[str, float] = {}
-        root_str = str(directory.resolve())
+        stack = [root]
+        while stack:
+            stack.extend(_DirectoryImageCache._scan_dir(stack.pop(), exclude_dirs, images, dir_mtimes))
+        return images, dir_mtimes
 
-        for root, dirs, files in os.walk(root_str):
-            dirs[:] = [d for d in dirs if d not in exclude_dirs]
+    @staticmethod
+    def _scan_dir(root: str, exclude_dirs: set[str], images: set[str], dir_mtimes: dict[str, float]) -> list[str]:
+        """List one directory into images/dir_mtimes; returns subdirs to descend."""
+        subdirs = []
+        # Same traversal as _collect_all_image_paths_in_dir: scandir's cached
+        # d_type answers the dir/file question without a stat per entry
+        try:
+            # Stat before listing so a change racing the scan leaves an
+            # older mtime behind and is picked up by the next check
             dir_mtimes[root] = os.stat(root).st_mtime
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        # Like os.walk, don't descend into symlinked dirs
+                        if not entry.is_symlink() and entry.name not in exclude_dirs:
+                            subdirs.append(entry.path)
+                    elif ThumbnailService.is_image_file(entry.name):
+                        images.add(entry.path)
+        except OSError:
+            pass
+        return subdirs
 
-            for file in files:
-                file_path = os.path.join(root, file)
-                if ThumbnailService.is_image_file(file_path):
-                    images.add(file_path)
 
-        return images, dir_mtimes
+_scan_pool: ThreadPoolExecutor | None = None
+_scan_pool_lock = threading.Lock()
+
+
+def _get_scan_pool() -> ThreadPoolExecutor:
+    """Return the shared directory-scan thread pool, creating it on first use."""
+    global _scan_pool
+    if _scan_pool is None:
+        with _scan_pool_lock:
+            if _scan_pool is None:
+                _scan_pool = ThreadPoolExecutor(
+                    max_workers=min(8, os.cpu_count() or 1),
+                    thread_name_prefix='igallery-scan',
+                )
+    return _scan_pool
+
+
+class _ViewRecorder:
+    """Records image views on a background thread, batching DB writes.
+
+    Views are written in one transaction per flush_interval (or per
+    batch_size views, whichever comes first).  View timestamps are taken
+    when a view is queued, so batching does not change least-recently-viewed
+    ordering; a view just becomes visible up to one batch later.  The
+    carousel writes its own pick with record_now() so the next pick never
+    repeats it, without waiting on anyone else's queued views.
+
+    A view of the same image that was last recorded for a database less
+    than dedupe_window seconds ago is dropped: the carousel records a view
+    when it picks an image and again when the browser fetches it.  Only
+    back-to-back repeats are dropped, so cycling through a small set of
+    images still records every view.
+
+    The worker thread exits after idle_timeout seconds without views and is
+    restarted by the next record(), so an idle recorder holds no thread.
+    Live recorders are flushed once at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        dedupe_window: float = 2.0,
+        idle_timeout: float = 30.0,
+        flush_interval: float = 1.0,
+    ):
+        self._queue: queue.Queue = queue.Queue()
+        self._batch_size = batch_size
+        self._dedupe_window = dedupe_window
+        self._idle_timeout = idle_timeout
+        self._flush_interval = flush_interval
+        # Set by flush() to cut the worker's collection window short
+        self._flush_requested = threading.Event()
+        self._last_view: dict[Database, tuple[str, float]] = {}
+        self._worker: threading.Thread | None = None
+        self._worker_lock = threading.Lock()
+        # Held while a batch is being written, so flush() can wait for it
+        self._write_lock = threading.Lock()
+        _view_recorders.add(self)
+
+    def _is_repeat(self, db: Database, image_path: str, now: float) -> bool:
+        last = self._last_view.get(db)
+        if last is not None and last[0] == image_path and now - last[1] < self._dedupe_window:
+            return True
+        self._last_view[db] = (image_path, now)
+        return False
+
+    def record(self, db: Database, image_path: str):
+        """Queue a view of image_path; returns without touching the DB."""
+        now = _time.time()
+        if self._is_repeat(db, image_path, now):
+            return
+        self._queue.put_nowait((db, image_path, now))
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, daemon=True)
+                    self._worker.start()
+
+    def record_now(self, db: Database, image_path: str):
+        """Write a single view from the calling thread.
+
+        Only this view is written; views queued by other requests are left
+        to the worker.
+        """
+        now = _time.time()
+        if self._is_repeat(db, image_path, now):
+            return
+        self._write([(db, image_path, now)])
+
+    def flush(self):
+        """Write the views queued so far and wait for any in-flight batch.
+
+        Views queued after the call starts are left to the worker, so a
+        steady stream of record() calls cannot keep flush() from returning.
+        """
+        self._flush_requested.set()
+        remaining = self._queue.qsize()
+        while remaining > 0:
+            batch = self._drain([], min(remaining, self._batch_size))
+            if not batch:
+                break
+            remaining -= len(batch)
+            self._write(batch)
+        # The worker holds this from dequeuing a batch until it is written
+        with self._write_lock:
+            self._flush_requested.clear()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._idle_timeout)
+            except queue.Empty:
+                # record() queues before checking _worker, so a view that
+                # races this exit is either seen here or starts a new worker
+                with self._worker_lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+            with self._write_lock:
+                # Let more views arrive so they share one transaction
+                if self._queue.qsize() < self._batch_size - 1:
+                    self._flush_requested.wait(self._flush_interval)
+                self._write(self._drain([item], self._batch_size))
+
+    def _drain(self, batch: list, limit: int) -> list:
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _write(batch: list):
+        views_by_db: dict[Database, list] = {}
+        for db, image_path, viewed_at in batch:
+            views_by_db.setdefault(db, []).append((image_path, viewed_at))
+        for db, views in views_by_db.items():
+            try:
+                db.record_views(views)
+            except Exception as e:
+                print(f"View recording error: {e}")
+
+
+# Weak so that apps (and their databases) can be collected; one exit hook
+# covers every recorder instead of one atexit registration per app
+_view_recorders: "weakref.WeakSet[_ViewRecorder]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_view_recorders():
+    for recorder in list(_view_recorders):
+        recorder.flush()
 
 
 def create_app(
@@ -189,6 +496,8 @@ def create_app(
     # Legacy single-root interface for backward compat (e.g. tests)
     gallery_root: str = None,
     db_path: str = None,
+    start_cleanup: bool = False,
+    cleanup_interval: float = 1800.0,
 ):
     """Create and configure Flask application.
 
@@ -197,6 +506,9 @@ def create_app(
         db_paths: List of paths to SQLite databases (one per root)
         gallery_root: Single gallery root (legacy, use gallery_roots instead)
         db_path: Single db path (legacy, use db_paths instead)
+        start_cleanup: Start the orphan cleanup in a background thread right
+            away instead of on the first request
+        cleanup_interval: Seconds between orphan cleanup passes
 
     Returns:
         Configured Flask application
@@ -215,12 +527,17 @@ def create_app(
     # Build roots registry
     roots = []
     for i, (root_path, root_db_path) in enumerate(zip(gallery_roots, db_paths)):
-        resolved = str(Path(root_path).resolve())
+        # Resolved once here so request handlers never re-resolve the root
+        resolved_path = Path(root_path).resolve()
+        resolved = str(resolved_path)
         db = Database(root_db_path)
         roots.append({
             'index': i,
-            'name': Path(resolved).name,
+            'name': resolved_path.name,
             'path': resolved,
+            'resolved_path': resolved_path,
+            'trash_dir': resolved_path / 'trash',
+            'trash_dir_str': str(resolved_path / 'trash'),
             'db_path': root_db_path,
             'db': db,
             'thumbnail_service': ThumbnailService(db),
@@ -234,51 +551,79 @@ def create_app(
     # Cached directory walker for carousel routes
     image_cache = _DirectoryImageCache()
 
+    # View history is written off the request path; flushed on exit
+    view_recorder = _ViewRecorder()
+    app.extensions['igallery_view_recorder'] = view_recorder
+
     # Track last-synced generation per (directory, db) to skip redundant sync_images
     _last_synced_generation: dict[tuple, int] = {}
     _sync_lock = threading.Lock()
 
     # Track cleanup status per root
-    cleanup_status = {'in_progress': False, 'last_run': None}
+    cleanup_status = {'thread': None, 'last_run': None}
+    app.extensions['igallery_cleanup_status'] = cleanup_status
+    cleanup_lock = threading.Lock()
+    # Set once the first cleanup pass has finished (successfully or not)
+    cleanup_done = threading.Event()
+    app.extensions['igallery_cleanup_done'] = cleanup_done
+    # Setting this ends the periodic cleanup loop after its current pass
+    cleanup_stop = threading.Event()
+    app.extensions['igallery_cleanup_stop'] = cleanup_stop
 
     def cleanup_orphaned_records_async():
         """Background task to cleanup orphaned database records for all roots."""
-        if cleanup_status['in_progress']:
-            return
-
-        cleanup_status['in_progress'] = True
         try:
             for root_info in roots:
-                gallery_path = Path(root_info['path']).resolve()
+                gallery_path = root_info['resolved_path']
                 if not gallery_path.exists():
                     continue  # Skip missing roots to avoid purging valid records
-                trash_path = gallery_path / "trash"
                 root_db = root_info['db']
 
-                valid_gallery = _collect_all_image_paths_in_dir(gallery_path, exclude_dirs={'trash'})
-                valid_trash = _collect_all_image_paths_in_dir(trash_path) if trash_path.exists() else set()
+                # One walk over the whole root, trash included, split by
+                # prefix: thumbnails and metadata are valid anywhere on disk,
+                # trash records only under trash/
+                valid_images = _collect_all_image_paths_in_dir(gallery_path, db=root_db)
+                trash_prefix = root_info['trash_dir_str'] + os.sep
+                valid_trash = {p for p in valid_images if p.startswith(trash_prefix)}
 
+                # Trash paths may stay in valid_images: the trash set wins
                 orphaned_thumbs, orphaned_meta, orphaned_trash = root_db.cleanup_orphaned_records(
-                    valid_gallery, valid_trash
+                    valid_images, valid_trash
                 )
 
                 if orphaned_thumbs or orphaned_meta or orphaned_trash:
                     print(f"Cleanup [{root_info['name']}]: Removed {orphaned_thumbs} thumbnails, {orphaned_meta} metadata, {orphaned_trash} trash records")
 
-            import time
-            cleanup_status['last_run'] = time.time()
+                root_db.compact()
+
+            cleanup_status['last_run'] = _time.time()
         except Exception as e:
             print(f"Background cleanup error: {e}")
         finally:
-            cleanup_status['in_progress'] = False
+            cleanup_done.set()
+
+    def cleanup_loop():
+        """Run the orphan cleanup now and then every cleanup_interval seconds."""
+        while not cleanup_stop.is_set():
+            cleanup_orphaned_records_async()
+            cleanup_stop.wait(cleanup_interval)
+
+    def start_background_cleanup():
+        """Start the persistent cleanup thread unless it is already running."""
+        with cleanup_lock:
+            if cleanup_status['thread'] is not None:
+                return
+            cleanup_status['thread'] = threading.Thread(
+                target=cleanup_loop, name='igallery-cleanup', daemon=True
+            )
+        cleanup_status['thread'].start()
 
     @app.before_request
     def lazy_cleanup():
-        """Trigger cleanup on first request only."""
-        if app.config.get('TESTING'):
+        """Start the cleanup thread on first request if it wasn't started at creation."""
+        if app.config.get('TESTING') or cleanup_status['thread'] is not None:
             return
-        if cleanup_status['last_run'] is None and not cleanup_status['in_progress']:
-            threading.Thread(target=cleanup_orphaned_records_async, daemon=True).start()
+        start_background_cleanup()
 
     def get_active_root():
         """Get active gallery root from request's 'root' query param."""
@@ -313,15 +658,19 @@ def create_app(
         """
         if active_root is None:
             active_root = get_active_root()
-        gallery_root = active_root['path']
+        gallery_root_resolved = active_root['resolved_path']
+        if not relative_path:
+            # The root itself: already resolved at startup
+            return gallery_root_resolved
         try:
-            current_dir = (Path(gallery_root) / relative_path).resolve()
-            gallery_root_resolved = Path(gallery_root).resolve()
-            if not str(current_dir).startswith(str(gallery_root_resolved)):
-                abort(403)
-            return current_dir
+            current_dir = (gallery_root_resolved / relative_path).resolve()
         except Exception:
             abort(400)
+        # Component-wise check: a sibling like /gallery_evil must not pass
+        # as being inside /gallery the way a string prefix match would
+        if not current_dir.is_relative_to(gallery_root_resolved):
+            abort(403)
+        return current_dir
 
     _roots_avail_cache = {'data': None, 'time': 0.0}
     _roots_avail_ttl = 5.0  # seconds
@@ -347,6 +696,23 @@ def create_app(
         _roots_avail_cache['time'] = now
         return result
 
+    # Rendered index pages keyed by root/path/page.  An entry is reused while
+    # the listed directory and every subdirectory shown on the page (whose
+    # preview image and item count are baked in) keep their mtimes.
+    _index_cache: dict[tuple, dict] = {}
+    _index_cache_lock = threading.Lock()
+    _index_cache_ttl = 60.0  # seconds; bounds staleness on coarse-mtime filesystems
+    _index_cache_max = 256
+
+    def _dir_mtimes_unchanged(dir_mtimes: dict[str, int]) -> bool:
+        for dir_path, mtime_ns in dir_mtimes.items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
     @app.route('/')
     def index():
         """Gallery index page with thumbnail grid."""
@@ -377,32 +743,64 @@ def create_app(
         relative_path = request.args.get('path', '')
         current_dir = validate_gallery_path(relative_path, active)
 
-        file_ops = FileOperations(str(current_dir), gallery_root=gallery_root)
-
         # Pagination
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
+        fetch_images_only = request.args.get('fetch_images_only') == 'true'
 
-        items, total_pages = file_ops.get_page_with_directories(page, per_page)
+        roots_info = _roots_with_availability()
+        cache_key = (
+            active['index'], relative_path, page, per_page, fetch_images_only,
+            tuple(r['available'] for r in roots_info),
+        )
+        now = _time.monotonic()
+        with _index_cache_lock:
+            cached = _index_cache.get(cache_key)
+        if cached and now - cached['time'] < _index_cache_ttl and _dir_mtimes_unchanged(cached['dir_mtimes']):
+            return app.response_class(cached['body'], mimetype=cached['mimetype'])
+
+        # Each listed directory is stat'd before it is read, so a change
+        # racing the listing or a preview scan invalidates the entry
+        dir_mtimes: dict[str, int] = {}
+        file_ops = FileOperations(str(current_dir), gallery_root=gallery_root)
+        items, total_pages = file_ops.get_page_with_directories(page, per_page, dir_mtimes)
+
+        def _cache_response(body: str, mimetype: str = 'text/html'):
+            response = app.response_class(body, mimetype=mimetype)
+            # Missing entries are directories whose stat failed
+            listed = 1 + sum(item['type'] == 'directory' for item in items)
+            if len(dir_mtimes) < listed:
+                return response
+            # A change in the same mtime tick would leave the entry valid
+            now_ns = _time.time_ns()
+            if any(now_ns - mtime_ns < _RACY_MTIME_NS for mtime_ns in dir_mtimes.values()):
+                return response
+            with _index_cache_lock:
+                if len(_index_cache) >= _index_cache_max:
+                    _index_cache.pop(next(iter(_index_cache)))
+                _index_cache[cache_key] = {
+                    'body': body, 'mimetype': mimetype, 'dir_mtimes': dir_mtimes, 'time': now,
+                }
+            return response
 
         # If this is an AJAX request, return JSON
-        if request.args.get('fetch_images_only') == 'true':
-            return jsonify({
+        if fetch_images_only:
+            return _cache_response(jsonify({
                 'success': True,
                 'items': items,
                 'page': page,
                 'total_pages': total_pages
-            })
+            }).get_data(as_text=True), 'application/json')
 
         # Build breadcrumbs
         breadcrumbs = []
         if relative_path:
-            parts = Path(relative_path).parts
-            for i, part in enumerate(parts):
-                path = '/'.join(parts[:i+1])
+            path = ''
+            for part in Path(relative_path).parts:
+                path = f'{path}/{part}' if path else part
                 breadcrumbs.append({'name': part, 'path': path})
 
-        return render_template(
+        return _cache_response(render_template(
             'index.html',
             items=items,
             page=page,
@@ -411,51 +809,59 @@ def create_app(
             current_path=relative_path,
             breadcrumbs=breadcrumbs,
             has_parent=relative_path != '',
-            roots=_roots_with_availability(),
+            roots=roots_info,
             root_index=root_index,
-        )
+        ))
 
-    @app.route('/thumbnail/<path:image_path>')
-    def thumbnail(image_path):
-        """Serve thumbnail for an image."""
-        active = get_active_root()
-        full_image_path = validate_gallery_path(image_path, active)
+    def serve_thumbnail(active, image_path: str):
+        """Serve a cached thumbnail with ETag/Last-Modified revalidation.
 
+        Args:
+            active: Root info dict owning the thumbnail cache
+            image_path: Absolute path of the source image
+
+        Returns:
+            Thumbnail response, or 304 if the client's copy is current
+        """
         try:
-            stat_result = os.stat(str(full_image_path))
+            stat_result = os.stat(image_path)
         except OSError:
             abort(404)
 
-        image_mtime = stat_result.st_mtime
-        last_modified = datetime.fromtimestamp(image_mtime, timezone.utc)
+        # HTTP dates have one-second resolution
+        last_modified = datetime.fromtimestamp(int(stat_result.st_mtime), timezone.utc)
+        etag = _stat_etag(stat_result)
 
-        # Check if client has a cached version
-        if_modified_since = request.headers.get('If-Modified-Since')
-        if if_modified_since:
-            try:
-                client_mtime = datetime.strptime(if_modified_since, '%a, %d %b %Y %H:%M:%S GMT')
-                if last_modified <= client_mtime:
-                    return make_response('', 304)
-            except ValueError:
-                pass
+        # werkzeug applies If-None-Match before If-Modified-Since; answer
+        # before touching the thumbnail cache
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
 
-        # Generate or retrieve thumbnail
         try:
-            thumbnail_data = active['thumbnail_service'].get_or_create_thumbnail(str(full_image_path))
-            response = make_response(send_file(
-                io.BytesIO(thumbnail_data),
-                mimetype='image/jpeg',
-                as_attachment=False
-            ))
-
-            response.headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
-            response.headers['Cache-Control'] = 'private, no-cache, no-store, must-revalidate'
-
-            return response
+            thumbnail_data = active['thumbnail_service'].get_or_create_thumbnail(
+                image_path, stat_result=stat_result
+            )
         except Exception as e:
             app.logger.error(f"Error generating thumbnail: {e}")
             abort(500)
 
+        response = app.response_class(thumbnail_data, mimetype='image/jpeg')
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Let the browser keep the tile but revalidate it: the URL is
+        # path-based, so a different image can later live at the same URL
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @app.route('/thumbnail/<path:image_path>')
+    def thumbnail(image_path):
+        """Serve thumbnail for an image."""
+        active = get_active_root()
+        full_image_path = validate_gallery_path(image_path, active)
+        return serve_thumbnail(active, str(full_image_path))
+
     @app.route('/image/<path:image_path>')
     def image(image_path):
         """Serve full-size image."""
@@ -463,14 +869,18 @@ def create_app(
         preload = request.args.get('preload', 'false') == 'true'
         full_image_path = validate_gallery_path(image_path, active)
 
-        if not full_image_path.exists():
-            abort(404)
+        # conditional=True answers If-None-Match/If-Modified-Since and Range
+        # requests without re-sending the body; a missing file raises 404
+        # from its own stat, so no separate existence check is needed
+        response = send_from_directory(
+            str(full_image_path.parent), full_image_path.name, conditional=True
+        )
 
         # Record view only if not preloading
         if not preload:
-            active['db'].record_view(str(full_image_path))
+            view_recorder.record(active['db'], str(full_image_path))
 
-        return send_file(str(full_image_path))
+        return response
 
     @app.route('/carousel')
     def carousel():
@@ -499,7 +909,6 @@ def create_app(
     def carousel_next():
         """Get next image for carousel (slideshow mode)."""
         active = get_active_root()
-        gallery_root = active['path']
         db = active['db']
 
         relative_path = request.args.get('path', '')
@@ -509,20 +918,23 @@ def create_app(
         gallery_images, generation = image_cache.get_images_with_generation(
             current_dir, exclude_dirs={'trash'}
         )
-        images = list(gallery_images)
 
-        if not images:
+        if not gallery_images:
             return jsonify({'error': 'No images found'}), 404
 
-        _sync_if_needed(db, (images, generation), current_dir)
-        selected_image = db.get_least_recently_viewed(images)
+        _sync_if_needed(db, (gallery_images, generation), current_dir)
+        selected_image = db.get_least_recently_viewed_under(str(current_dir), gallery_images)
+        if selected_image is None:
+            # Records missing (e.g. database deleted since the last sync)
+            db.sync_images(gallery_images)
+            selected_image = db.get_least_recently_viewed_under(str(current_dir), gallery_images)
 
         if not preload:
-            db.record_view(selected_image)
+            # Written now so the next pick already sees it
+            view_recorder.record_now(db, selected_image)
 
         selected_path = Path(selected_image)
-        gallery_root_path = Path(gallery_root).resolve()
-        relative_to_gallery = selected_path.relative_to(gallery_root_path)
+        relative_to_gallery = selected_path.relative_to(active['resolved_path'])
 
         image_name = relative_to_gallery.name
 
@@ -536,7 +948,6 @@ def create_app(
     def carousel_random():
         """Get random image for carousel (random mode)."""
         active = get_active_root()
-        gallery_root = active['path']
         db = active['db']
 
         relative_path = request.args.get('path', '')
@@ -555,11 +966,10 @@ def create_app(
         selected_image = db.get_random_image(images)
 
         if not preload:
-            db.record_view(selected_image)
+            view_recorder.record(db, selected_image)
 
         selected_path = Path(selected_image)
-        gallery_root_path = Path(gallery_root).resolve()
-        relative_to_gallery = selected_path.relative_to(gallery_root_path)
+        relative_to_gallery = selected_path.relative_to(active['resolved_path'])
 
         image_name = relative_to_gallery.name
 
@@ -583,19 +993,19 @@ def create_app(
         if not image_name:
             return jsonify({'error': 'No image specified'}), 400
 
-        current_dir = validate_gallery_path(relative_path, active)
-
-        file_ops = FileOperations(str(current_dir), gallery_root=gallery_root)
-        image_path = current_dir / image_name
+        # Validate the image path itself, not just its folder: image_name may
+        # carry '..' or an absolute path
+        image_path = validate_gallery_path(os.path.join(relative_path, image_name), active)
 
         if not image_path.exists():
             return jsonify({'error': 'Image not found'}), 404
 
+        file_ops = FileOperations(str(image_path.parent), gallery_root=gallery_root)
+
         try:
-            resolved_before = str(image_path.resolve())
             trash_path = file_ops.move_to_trash(str(image_path))
             db.add_to_trash(trash_path, str(image_path))
-            image_cache.remove_image(resolved_before)
+            image_cache.remove_image(str(image_path))
             return jsonify({'success': True})
         except Exception as e:
             app.logger.error(f"Error moving to trash: {e}")
@@ -609,19 +1019,19 @@ def create_app(
         db = active['db']
         root_index = get_root_param()
 
-        trash_dir = Path(gallery_root) / "trash"
-        db.sync_trash_folder(str(trash_dir), gallery_root)
+        db.sync_trash_folder(active['trash_dir_str'], gallery_root)
 
         trashed_images = db.list_trashed_images()
 
+        # Plain string prefix test: no Path objects per item
+        trash_prefix = active['trash_dir_str'] + os.sep
         trash_items = []
         for item in trashed_images:
-            trash_path = Path(item['trash_path'])
-            try:
-                rel_path = trash_path.relative_to(Path(gallery_root) / "trash")
-                display_path = str(rel_path)
-            except ValueError:
-                display_path = trash_path.name
+            trash_path = item['trash_path']
+            if trash_path.startswith(trash_prefix):
+                display_path = trash_path[len(trash_prefix):]
+            else:
+                display_path = os.path.basename(trash_path)
 
             trash_items.append({
                 'path': display_path,
@@ -641,59 +1051,23 @@ def create_app(
     def trash_thumbnail(relative_path):
         """Serve thumbnail for a trashed image."""
         active = get_active_root()
-        trash_dir = Path(active['path']) / "trash"
-        image_path = trash_dir / relative_path
-
-        try:
-            stat_result = os.stat(str(image_path))
-        except OSError:
+        safe_path = safe_join(active['trash_dir_str'], relative_path)
+        if safe_path is None:
             abort(404)
-
-        image_mtime = stat_result.st_mtime
-        last_modified = datetime.fromtimestamp(image_mtime, timezone.utc)
-
-        if_modified_since = request.headers.get('If-Modified-Since')
-        if if_modified_since:
-            try:
-                client_mtime = datetime.strptime(if_modified_since, '%a, %d %b %Y %H:%M:%S GMT')
-                if last_modified <= client_mtime:
-                    return make_response('', 304)
-            except ValueError:
-                pass
-
-        try:
-            thumbnail_data = active['thumbnail_service'].get_or_create_thumbnail(str(image_path))
-            response = make_response(send_file(
-                io.BytesIO(thumbnail_data),
-                mimetype='image/jpeg',
-                as_attachment=False
-            ))
-
-            response.headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
-            response.headers['Cache-Control'] = 'private, no-cache, no-store, must-revalidate'
-
-            return response
-        except Exception as e:
-            app.logger.error(f"Error generating thumbnail: {e}")
-            abort(500)
+        return serve_thumbnail(active, safe_path)
 
     @app.route('/trash/image/<path:relative_path>')
     def trash_image(relative_path):
         """Serve full-size trashed image."""
         active = get_active_root()
-        trash_dir = Path(active['path']) / "trash"
-        image_path = trash_dir / relative_path
-
-        if not image_path.exists():
-            abort(404)
 
-        return send_file(str(image_path))
+        # Rejects paths escaping trash_dir and 404s on missing files
+        return send_from_directory(active['trash_dir_str'], relative_path, conditional=True)
 
     @app.route('/trash/restore', methods=['POST'])
     def restore_from_trash():
         """Restore an image from trash to its original location."""
         active = get_active_root()
-        gallery_root = active['path']
         db = active['db']
 
         try:
@@ -703,7 +1077,8 @@ def create_app(
             if not relative_trash_path:
                 return jsonify({'error': 'No trash path provided'}), 400
 
-            trash_path = str((Path(gallery_root) / "trash" / relative_trash_path).resolve())
+            trash_dir = active['trash_dir']
+            trash_path = str((trash_dir / relative_trash_path).resolve())
 
             trash_item = db.get_trash_item(trash_path)
             if not trash_item:
@@ -711,27 +1086,29 @@ def create_app(
 
             original_path = trash_item['original_path']
 
-            if not Path(trash_path).exists():
-                return jsonify({'error': 'Trash file not found on disk'}), 404
-
-            Path(original_path).parent.mkdir(parents=True, exist_ok=True)
-
-            import shutil
-            shutil.move(trash_path, original_path)
+            # Try the move first; only on failure work out whether the trash
+            # file is gone or the original folder needs recreating
+            try:
+                move_file(trash_path, original_path)
+            except FileNotFoundError:
+                if not os.path.lexists(trash_path):
+                    return jsonify({'error': 'Trash file not found on disk'}), 404
+                Path(original_path).parent.mkdir(parents=True, exist_ok=True)
+                move_file(trash_path, original_path)
 
             db.remove_from_trash(trash_path)
-
-            trash_dir = Path(gallery_root) / "trash"
-            try:
-                parent_dir = Path(trash_path).parent
-                while parent_dir != trash_dir and parent_dir.exists():
-                    if not any(parent_dir.iterdir()):
-                        parent_dir.rmdir()
-                        parent_dir = parent_dir.parent
-                    else:
-                        break
-            except OSError:
-                pass
+            image_cache.add_image(original_path)
+
+            # Prune now-empty trash subfolders bottom-up; rmdir itself fails
+            # on a non-empty (or missing) folder, so no listing is needed
+            parent_dir = os.path.dirname(trash_path)
+            trash_dir_str = active['trash_dir_str']
+            while parent_dir.startswith(trash_dir_str + os.sep):
+                try:
+                    os.rmdir(parent_dir)
+                except OSError:
+                    break
+                parent_dir = os.path.dirname(parent_dir)
 
             return jsonify({'success': True, 'original_path': original_path})
         except Exception as e:
@@ -742,34 +1119,36 @@ def create_app(
     def delete_all_trash():
         """Permanently delete all files in trash."""
         active = get_active_root()
-        gallery_root = active['path']
         db = active['db']
 
         try:
-            trashed_images = db.list_trashed_images()
-
-            for item in trashed_images:
+            # Only tracked files are deleted; anything else under trash/ stays
+            trash_dir = active['trash_dir_str']
+            deleted_paths = []
+            parent_dirs = set()
+            for item in db.list_trashed_images():
                 trash_path = item['trash_path']
-                if Path(trash_path).exists():
-                    Path(trash_path).unlink()
-
-            trash_paths = [item['trash_path'] for item in trashed_images]
-            db.bulk_delete_trash(trash_paths)
-
-            deleted_count = len(trashed_images)
-
-            trash_dir = Path(gallery_root) / "trash"
-            if trash_dir.exists():
-                for root, dirs, files in os.walk(trash_dir, topdown=False):
-                    for dir_name in dirs:
-                        dir_path = Path(root) / dir_name
-                        try:
-                            if not any(dir_path.iterdir()):
-                                dir_path.rmdir()
-                        except OSError:
-                            pass
+                try:
+                    os.unlink(trash_path)
+                except FileNotFoundError:
+                    pass
+                deleted_paths.append(trash_path)
+                parent_dirs.add(os.path.dirname(trash_path))
+
+            # Records go only after their files, so a failed write leaves
+            # records of missing files for the orphan cleanup, never the reverse
+            db.bulk_delete_trash(deleted_paths)
+
+            # Prune directories emptied above, deepest first, up to trash/
+            for dir_path in sorted(parent_dirs, key=len, reverse=True):
+                while dir_path.startswith(trash_dir + os.sep):
+                    try:
+                        os.rmdir(dir_path)
+                    except OSError:
+                        break
+                    dir_path = os.path.dirname(dir_path)
 
-            return jsonify({'success': True, 'deleted': deleted_count})
+            return jsonify({'success': True, 'deleted': len(deleted_paths)})
         except Exception as e:
             app.logger.error(f"Error deleting trash: {e}")
             return jsonify({'error': str(e)}), 500
@@ -843,10 +1222,12 @@ def create_app(
 
             full_image_path = validate_gallery_path(image_path, active)
 
-            if not full_image_path.exists():
+            try:
+                st = os.stat(full_image_path)
+            except FileNotFoundError:
                 return jsonify({'error': 'Image not found'}), 404
 
-            if not full_image_path.is_file():
+            if not stat.S_ISREG(st.st_mode):
                 return jsonify({'error': 'Not a file'}), 400
 
             file_ops = FileOperations(str(full_image_path.parent), gallery_root=gallery_root)
@@ -855,7 +1236,8 @@ def create_app(
             if not success:
                 return jsonify({'error': 'Image is already at gallery root'}), 400
 
-            old_path_str = str(full_image_path.resolve())
+            # validate_gallery_path already returned a resolved path
+            old_path_str = str(full_image_path)
             db.update_image_path(old_path_str, new_path)
             image_cache.move_image(old_path_str, new_path)
 
@@ -866,6 +1248,9 @@ def create_app(
             app.logger.error(f"Error moving file up: {e}")
             return jsonify({'error': str(e)}), 500
 
+    if start_cleanup:
+        start_background_cleanup()
+
     return app
 
 
@@ -893,6 +1278,23 @@ def main():
         default=None,
         help='Root directory for image gallery (can be specified multiple times)'
     )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=int(os.environ.get('IGALLERY_THREADS', 8)),
+        help='Worker threads for the waitress server (default: $IGALLERY_THREADS or 8)'
+    )
+    parser.add_argument(
+        '--dev',
+        action='store_true',
+        default=os.environ.get('IGALLERY_DEV', '') not in ('', '0'),
+        help='Run the Flask development server with debug mode (default: set if $IGALLERY_DEV is set)'
+    )
+    parser.add_argument(
+        '--x-sendfile',
+        action='store_true',
+        help='Send full-size images via X-Sendfile (requires a front-end server that handles it)'
+    )
 
     args = parser.parse_args()
 
@@ -903,7 +1305,11 @@ def main():
     app = create_app(
         gallery_roots=gallery_roots,
         db_paths=db_paths,
+        start_cleanup=True,
     )
+    # Full-size images then go out as an empty response with an X-Sendfile
+    # header, and the front-end server streams the file with sendfile(2)
+    app.config['USE_X_SENDFILE'] = args.x_sendfile
 
     print(f"Starting Image Trashing Service on http://{args.host}:{args.port}")
     if len(gallery_roots) == 1:
@@ -920,7 +1326,17 @@ def main():
     log.setLevel(logging.ERROR)
 
     try:
-        app.run(host=args.host, port=args.port, debug=True, use_reloader=False)
+        if args.dev:
+            app.run(host=args.host, port=args.port, debug=True, use_reloader=False)
+        else:
+            try:
+                from waitress import serve
+            except ImportError:
+                # waitress is optional (pip install igallery[server]); the
+                # threaded dev server still serves requests concurrently
+                app.run(host=args.host, port=args.port, threaded=True)
+            else:
+                serve(app, host=args.host, port=args.port, threads=args.threads)
     except (KeyboardInterrupt, SystemExit):
         print("\nShutdown complete")
         sys.exit(0)
@@ -14,28 +14,44 @@ Updated timestamps (change over time):
 - trash.trashed_at: When image was moved to trash (updated if re-trashed)
 
 Cache validation timestamps (track source file changes):
-- thumbnails.image_mtime: Source image modification time for cache invalidation
+- thumbnails.image_mtime_ns: Source image st_mtime_ns for cache invalidation
 """
 
+import json
+import os
+import queue
+import random
 import sqlite3
 import threading
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Container, Iterable, Optional, Tuple
 import time
 
 
 class Database:
     """Manages SQLite database for thumbnail cache and image metadata."""
 
-    def __init__(self, db_path: str = ".igallery.db"):
+    # Stored in PRAGMA user_version once all migrations in
+    # _init_schema_on_connection have been applied.  Bump it whenever that
+    # method gains a new migration.
+    SCHEMA_VERSION = 2
+
+    # directory_index mtime for directories that every scan must re-list
+    UNTRUSTED_MTIME_NS = -1
+
+    def __init__(self, db_path: str = ".igallery.db", pool_size: int = 8):
         """Initialize database connection.
 
         Args:
             db_path: Path to SQLite database file
+            pool_size: Maximum number of idle connections kept open for reuse
         """
         self.db_path = db_path
-        self._local = threading.local()
+        # LIFO so the most recently used (warmest) connection is reused first
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        # Connection of the transaction() open on the current thread, if any
+        self._tx = threading.local()
         self._init_schema()
 
     def _init_schema(self):
@@ -53,21 +69,36 @@ class Database:
     def _init_schema_on_connection(self, conn):
         """Create database tables on an existing connection.
 
+        The CREATE ... IF NOT EXISTS statements always run, so a missing
+        table or index is recreated even at SCHEMA_VERSION.  Migrations,
+        including the per-row scans, only run when user_version is behind.
+
         Args:
             conn: Active SQLite connection
         """
         cursor = conn.cursor()
 
+        cursor.execute("PRAGMA user_version")
+        migrate = cursor.fetchone()[0] != self.SCHEMA_VERSION
+
+        # Migration: thumbnails were keyed on a REAL st_mtime, whose float
+        # equality breaks when filesystems round differently.  The table is
+        # only a cache, so drop it and let thumbnails regenerate.
+        if migrate:
+            cursor.execute("PRAGMA table_info(thumbnails)")
+            if 'image_mtime' in [col[1] for col in cursor.fetchall()]:
+                cursor.execute("DROP TABLE thumbnails")
+
         # Thumbnail cache table - stores thumbnail as BLOB
         # Timestamps:
         #   - created_at: Immutable - set once when thumbnail is first created
-        #   - image_mtime: Source image modification time for cache validation
+        #   - image_mtime_ns: Source image st_mtime_ns for cache validation
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS thumbnails (
                 image_path TEXT PRIMARY KEY,
                 thumbnail_data BLOB NOT NULL,
                 created_at REAL NOT NULL,
-                image_mtime REAL NOT NULL,
+                image_mtime_ns INTEGER NOT NULL,
                 image_size INTEGER NOT NULL
             )
         """)
@@ -77,50 +108,87 @@ class Database:
         #   - last_viewed_at: Updated each time image is viewed (NULL = never viewed)
         #   - file_created_at: Immutable creation timestamp using st_mtime
         #     (For images, mtime effectively equals creation time since they're rarely modified)
-        cursor.execute("""
+        # WITHOUT ROWID: rows live in the image_path B-tree itself, so path
+        # lookups and upserts touch one B-tree instead of a PK index plus
+        # the rowid table
+        image_metadata_sql = """
             CREATE TABLE IF NOT EXISTS image_metadata (
                 image_path TEXT PRIMARY KEY,
                 last_viewed_at REAL,
                 file_created_at REAL
-            )
-        """)
-
-        # Migration: Rename file_mtime to file_created_at (or add if missing)
-        cursor.execute("PRAGMA table_info(image_metadata)")
-        columns = [col[1] for col in cursor.fetchall()]
-
-        if 'file_mtime' in columns and 'file_created_at' not in columns:
-            # Rename existing column
-            cursor.execute("ALTER TABLE image_metadata RENAME COLUMN file_mtime TO file_created_at")
-        elif 'file_created_at' not in columns:
-            # Add new column and populate for existing records
-            cursor.execute("ALTER TABLE image_metadata ADD COLUMN file_created_at REAL")
+            ) WITHOUT ROWID
+        """
+        cursor.execute(image_metadata_sql)
+
+        if migrate:
+            # Migration: Rename file_mtime to file_created_at (or add if missing)
+            cursor.execute("PRAGMA table_info(image_metadata)")
+            columns = [col[1] for col in cursor.fetchall()]
+
+            if 'file_mtime' in columns and 'file_created_at' not in columns:
+                # Rename existing column
+                cursor.execute("ALTER TABLE image_metadata RENAME COLUMN file_mtime TO file_created_at")
+            elif 'file_created_at' not in columns:
+                # Add new column and populate for existing records
+                cursor.execute("ALTER TABLE image_metadata ADD COLUMN file_created_at REAL")
+
+                # Populate file_created_at for existing records using st_mtime
+                cursor.execute("SELECT image_path FROM image_metadata")
+                rows = cursor.fetchall()
+                for row in rows:
+                    image_path = row[0]
+                    try:
+                        mtime = Path(image_path).stat().st_mtime
+                        cursor.execute(
+                            "UPDATE image_metadata SET file_created_at = ? WHERE image_path = ?",
+                            (mtime, image_path)
+                        )
+                    except (OSError, FileNotFoundError):
+                        # File doesn't exist - use epoch time
+                        cursor.execute(
+                            "UPDATE image_metadata SET file_created_at = ? WHERE image_path = ?",
+                            (0.0, image_path)
+                        )
 
-            # Populate file_created_at for existing records using st_mtime
-            cursor.execute("SELECT image_path FROM image_metadata")
-            rows = cursor.fetchall()
-            for row in rows:
-                image_path = row[0]
-                try:
-                    mtime = Path(image_path).stat().st_mtime
-                    cursor.execute(
-                        "UPDATE image_metadata SET file_created_at = ? WHERE image_path = ?",
-                        (mtime, image_path)
-                    )
-                except (OSError, FileNotFoundError):
-                    # File doesn't exist - use epoch time
-                    cursor.execute(
-                        "UPDATE image_metadata SET file_created_at = ? WHERE image_path = ?",
-                        (0.0, image_path)
-                    )
+            # Migration: Rebuild image_metadata as WITHOUT ROWID (after the
+            # column migrations above, so the copy sees the final columns)
+            self._migrate_to_without_rowid(
+                cursor, 'image_metadata', image_metadata_sql,
+                ('image_path', 'last_viewed_at', 'file_created_at')
+            )
 
         # Trash table - tracks trashed images
-        cursor.execute("""
+        trash_sql = """
             CREATE TABLE IF NOT EXISTS trash (
                 trash_path TEXT PRIMARY KEY,
                 original_path TEXT NOT NULL,
                 trashed_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """
+        cursor.execute(trash_sql)
+        if migrate:
+            self._migrate_to_without_rowid(
+                cursor, 'trash', trash_sql, ('trash_path', 'original_path', 'trashed_at')
             )
+
+        # Migration: the directory index used to store JSON listings of
+        # each directory; it is only a cache, so drop it and rebuild
+        if migrate:
+            cursor.execute("PRAGMA table_info(directory_index)")
+            if 'images' in [col[1] for col in cursor.fetchall()]:
+                cursor.execute("DROP TABLE directory_index")
+
+        # Directory index - lets gallery scans skip directories whose mtime
+        # is unchanged.  Adding, removing or renaming an entry updates the
+        # directory's mtime, so an unchanged mtime means an unchanged listing.
+        # Subdirectories and images are derived by path prefix from this
+        # table and the tracked images rather than stored per directory.
+        #   - mtime_ns: st_mtime_ns at the last listing, or UNTRUSTED_MTIME_NS
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS directory_index (
+                dir_path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL
+            ) WITHOUT ROWID
         """)
 
         # Create indexes for performance
@@ -134,96 +202,202 @@ class Database:
             ON trash(trashed_at DESC)
         """)
 
-        # Migration: Clean up last_viewed_at for images that were never actually viewed
-        # In old behavior, sync_images set last_viewed_at = mtime for new images
-        # Now we use NULL to indicate never viewed, so we need to fix existing data
-        cursor.execute("SELECT image_path, last_viewed_at FROM image_metadata WHERE last_viewed_at IS NOT NULL")
-        rows = cursor.fetchall()
+        if migrate:
+            # Migration: Clean up last_viewed_at for images that were never actually viewed
+            # In old behavior, sync_images set last_viewed_at = mtime for new images
+            # Now we use NULL to indicate never viewed, so we need to fix existing data
+            cursor.execute("SELECT image_path, last_viewed_at FROM image_metadata WHERE last_viewed_at IS NOT NULL")
+            rows = cursor.fetchall()
 
-        for row in rows:
-            image_path, last_viewed_at = row[0], row[1]
-            try:
-                file_mtime = Path(image_path).stat().st_mtime
-                # If timestamps match, image was never viewed - set to NULL
-                if abs(last_viewed_at - file_mtime) < 0.001:
-                    cursor.execute(
-                        "UPDATE image_metadata SET last_viewed_at = NULL WHERE image_path = ?",
-                        (image_path,)
-                    )
-            except (OSError, FileNotFoundError):
-                # File doesn't exist - leave last_viewed_at as-is
-                pass
+            for row in rows:
+                image_path, last_viewed_at = row[0], row[1]
+                try:
+                    file_mtime = Path(image_path).stat().st_mtime
+                    # If timestamps match, image was never viewed - set to NULL
+                    if abs(last_viewed_at - file_mtime) < 0.001:
+                        cursor.execute(
+                            "UPDATE image_metadata SET last_viewed_at = NULL WHERE image_path = ?",
+                            (image_path,)
+                        )
+                except (OSError, FileNotFoundError):
+                    # File doesn't exist - leave last_viewed_at as-is
+                    pass
+
+            cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
 
         conn.commit()
 
-    def _get_or_create_connection(self):
-        """Get existing thread-local connection or create a new one.
+    @staticmethod
+    def _migrate_to_without_rowid(cursor, table: str, create_sql: str, columns: Tuple[str, ...]):
+        """Rebuild a rowid table created by an older version as WITHOUT ROWID.
+
+        Indexes on the old table are dropped with it; the caller's
+        CREATE INDEX IF NOT EXISTS statements recreate them afterwards.
 
-        Reuses a persistent connection per thread. Schema is only checked
-        when a new connection is created, not on every call.
+        Args:
+            cursor: Cursor on the connection being initialized
+            table: Table name
+            create_sql: CREATE TABLE IF NOT EXISTS statement for the new layout
+            columns: Columns to copy; the first is the primary key
         """
-        conn = getattr(self._local, 'conn', None)
-        if conn is not None:
-            return conn
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        row = cursor.fetchone()
+        if row is None or 'WITHOUT ROWID' in row[0].upper():
+            return
 
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA journal_mode=WAL")
-        # Check schema only once per new connection
-        cursor = conn.cursor()
+        column_list = ', '.join(columns)
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_rowid_old")
+        cursor.execute(create_sql)
+        # WITHOUT ROWID enforces NOT NULL on the key, which rowid tables don't
         cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='thumbnails'"
+            f"INSERT OR IGNORE INTO {table} ({column_list}) "
+            f"SELECT {column_list} FROM {table}_rowid_old WHERE {columns[0]} IS NOT NULL"
         )
-        if not cursor.fetchone():
-            self._init_schema_on_connection(conn)
-        self._local.conn = conn
+        cursor.execute(f"DROP TABLE {table}_rowid_old")
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open and configure a new connection for the pool.
+
+        Schema is only checked when a connection is opened, not on every call.
+        """
+        # Long-lived pooled connections run a fixed set of statements; keep
+        # them all prepared instead of the default 128
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent with NORMAL sync; only the last commits can be
+        # lost on power failure, never the database itself
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB memory-mapped reads
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # Recreates any missing table, e.g. after the file was deleted
+        self._init_schema_on_connection(conn)
         return conn
 
-    def _close_connection(self):
-        """Close the thread-local connection if it exists."""
-        conn = getattr(self._local, 'conn', None)
-        if conn is not None:
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """Take an idle connection from the pool, opening one if none is free."""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._open_connection()
+
+    def _release_connection(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, closing it if the pool is full."""
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            self._close_connection(conn)
+
+    @staticmethod
+    def _close_connection(conn: sqlite3.Connection):
+        """Close a connection, refreshing planner statistics first."""
+        try:
+            # Refresh query planner statistics for tables that need it
+            conn.execute("PRAGMA optimize")
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close every idle pooled connection."""
+        while True:
             try:
-                conn.close()
-            except Exception:
-                pass
-            self._local.conn = None
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            self._close_connection(conn)
 
     @contextmanager
     def _get_connection(self):
         """Context manager for database connections.
 
-        Uses a persistent thread-local connection. On error, closes and
-        retries once to handle database deletion/corruption.
+        Borrows a long-lived connection from the pool and returns it
+        afterwards, so SQLite's page cache stays warm across calls and
+        threads.  Opening is retried once to handle database deletion;
+        a connection that raised OperationalError is discarded rather
+        than pooled.
         """
+        conn = getattr(self._tx, 'conn', None)
+        if conn is not None:
+            # Inside transaction(): share its connection, which it releases
+            yield conn
+            return
+
+        try:
+            conn = self._acquire_connection()
+        except sqlite3.OperationalError:
+            conn = self._open_connection()
         try:
-            conn = self._get_or_create_connection()
             yield conn
         except sqlite3.OperationalError:
-            self._close_connection()
-            conn = self._get_or_create_connection()
+            self._close_connection(conn)
+            raise
+        except BaseException:
+            conn.rollback()
+            self._release_connection(conn)
+            raise
+        else:
+            self._release_connection(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Group several writes into a single BEGIN IMMEDIATE transaction.
+
+        Database methods called on this thread inside the block share its
+        connection and skip their own commits, so a burst of writes costs
+        one commit.  Nested calls join the outer transaction.
+
+        Yields:
+            The connection the transaction runs on
+        """
+        conn = getattr(self._tx, 'conn', None)
+        if conn is not None:
             yield conn
+            return
+
+        with self._get_connection() as conn:
+            # Take the write lock up front so a read-then-write block can't
+            # fail with SQLITE_BUSY when upgrading its lock mid-way
+            conn.execute("BEGIN IMMEDIATE")
+            self._tx.conn = conn
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self._tx.conn = None
+
+    def _commit(self, conn: sqlite3.Connection):
+        """Commit unless the connection belongs to an open transaction()."""
+        if conn is not getattr(self._tx, 'conn', None):
+            conn.commit()
 
-    def get_thumbnail(self, image_path: str, image_mtime: float) -> Optional[bytes]:
+    def get_thumbnail(self, image_path: str, image_mtime_ns: int) -> Optional[bytes]:
         """Get cached thumbnail data if it exists and is up-to-date.
 
         Args:
             image_path: Path to the original image
-            image_mtime: Modification time of the original image
+            image_mtime_ns: Modification time of the original image (st_mtime_ns)
 
         Returns:
             Thumbnail data as bytes if valid, None otherwise
         """
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT thumbnail_data, image_mtime FROM thumbnails WHERE image_path = ?",
+            row = conn.execute(
+                "SELECT thumbnail_data, image_mtime_ns FROM thumbnails WHERE image_path = ?",
                 (image_path,)
-            )
-            row = cursor.fetchone()
+            ).fetchone()
 
-            if row and row['image_mtime'] == image_mtime:
-                return row['thumbnail_data']
+            # Positional access: this runs once per thumbnail in a grid
+            if row and row[1] == image_mtime_ns:
+                return row[0]
 
             return None
 
@@ -231,7 +405,7 @@ class Database:
         self,
         image_path: str,
         thumbnail_data: bytes,
-        image_mtime: float,
+        image_mtime_ns: int,
         image_size: int
     ):
         """Save thumbnail to cache.
@@ -242,7 +416,7 @@ class Database:
         Args:
             image_path: Path to the original image
             thumbnail_data: Thumbnail image data as bytes
-            image_mtime: Modification time of the original image
+            image_mtime_ns: Modification time of the original image (st_mtime_ns)
             image_size: Size of the original image in bytes
         """
         with self._get_connection() as conn:
@@ -250,42 +424,59 @@ class Database:
             cursor.execute(
                 """
                 INSERT INTO thumbnails
-                (image_path, thumbnail_data, created_at, image_mtime, image_size)
+                (image_path, thumbnail_data, created_at, image_mtime_ns, image_size)
                 VALUES (?, ?, ?, ?, ?)
                 ON CONFLICT(image_path) DO UPDATE SET
                     thumbnail_data = excluded.thumbnail_data,
-                    image_mtime = excluded.image_mtime,
+                    image_mtime_ns = excluded.image_mtime_ns,
                     image_size = excluded.image_size
                     -- created_at is NOT updated, preserving original creation time
                 """,
-                (image_path, thumbnail_data, time.time(), image_mtime, image_size)
+                (image_path, thumbnail_data, time.time(), image_mtime_ns, image_size)
             )
-            conn.commit()
+            self._commit(conn)
 
-    def sync_images(self, image_paths: list[str]):
+    def sync_images(self, image_paths: Iterable[str]):
         """Sync image metadata for all images.
 
         New images are added with:
         - last_viewed_at = NULL (indicates never viewed)
         - file_created_at = st_mtime (immutable creation timestamp)
 
-        Uses INSERT OR IGNORE to skip existing rows in a single batch,
-        avoiding per-image SELECT queries.
+        The incoming paths are bulk-loaded into a temp table and diffed
+        against image_metadata in one query, so only paths that are not
+        tracked yet are stat'ed and inserted.
 
         Args:
-            image_paths: List of all image paths to sync
+            image_paths: All image paths to sync; any iterable, consumed once
         """
         if not image_paths:
-            return
+            return  # Empty container (a generator is always truthy)
 
-        with self._get_connection() as conn:
+        with self.transaction() as conn:
             cursor = conn.cursor()
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS _incoming (image_path TEXT PRIMARY KEY)"
+            )
+            try:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO _incoming (image_path) VALUES (?)",
+                    ((path,) for path in image_paths)
+                )
+                cursor.execute("""
+                    SELECT i.image_path FROM _incoming i
+                    LEFT JOIN image_metadata m USING (image_path)
+                    WHERE m.image_path IS NULL
+                """)
+                new_paths = [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.execute("DELETE FROM _incoming")
 
             rows = []
-            for path in image_paths:
+            for path in new_paths:
                 try:
-                    mtime = Path(path).stat().st_mtime
-                except (OSError, FileNotFoundError):
+                    mtime = os.stat(path).st_mtime
+                except OSError:
                     mtime = 0.0
                 rows.append((path, mtime))
 
@@ -296,7 +487,6 @@ class Database:
                 """,
                 rows
             )
-            conn.commit()
 
     def record_view(self, image_path: str):
         """Record that an image was viewed.
@@ -314,11 +504,37 @@ class Database:
                 INSERT INTO image_metadata (image_path, last_viewed_at)
                 VALUES (?, ?)
                 ON CONFLICT(image_path) DO UPDATE SET
-                    last_viewed_at = ?
+                    last_viewed_at = excluded.last_viewed_at
                 """,
-                (image_path, time.time(), time.time())
+                (image_path, time.time())
             )
-            conn.commit()
+            self._commit(conn)
+
+    def record_views(self, views: list[Tuple[str, float]]):
+        """Record a batch of image views in a single transaction.
+
+        A view older than the one already stored is ignored, so batches
+        written out of order never move an image's last view back.
+
+        Args:
+            views: List of (image_path, viewed_at) tuples, oldest first
+        """
+        if not views:
+            return
+
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT INTO image_metadata (image_path, last_viewed_at)
+                VALUES (?, ?)
+                ON CONFLICT(image_path) DO UPDATE SET
+                    last_viewed_at = MAX(excluded.last_viewed_at,
+                        IFNULL(last_viewed_at, excluded.last_viewed_at))
+                """,
+                views
+            )
+            self._commit(conn)
 
     def get_least_recently_viewed(self, image_paths: list[str]) -> Optional[str]:
         """Get the least recently viewed image from a list.
@@ -341,21 +557,22 @@ class Database:
         with self._get_connection() as conn:
             cursor = conn.cursor()
 
-            # Create placeholders for SQL IN clause
-            placeholders = ','.join('?' * len(image_paths))
+            # Bind the list as one JSON array: the statement text stays
+            # constant (statement cache hits) and there is no parameter limit
+            paths_json = json.dumps(image_paths)
 
             # First, try to get an unviewed image (last_viewed_at IS NULL)
             # ordered by file creation time (oldest first)
             cursor.execute(
-                f"""
+                """
                 SELECT image_path
                 FROM image_metadata
-                WHERE image_path IN ({placeholders})
+                WHERE image_path IN (SELECT value FROM json_each(?))
                 AND last_viewed_at IS NULL
                 ORDER BY file_created_at ASC
                 LIMIT 1
                 """,
-                image_paths
+                (paths_json,)
             )
 
             row = cursor.fetchone()
@@ -364,15 +581,15 @@ class Database:
 
             # No unviewed images - get the least recently viewed
             cursor.execute(
-                f"""
+                """
                 SELECT image_path
                 FROM image_metadata
-                WHERE image_path IN ({placeholders})
+                WHERE image_path IN (SELECT value FROM json_each(?))
                 AND last_viewed_at IS NOT NULL
                 ORDER BY last_viewed_at ASC
                 LIMIT 1
                 """,
-                image_paths
+                (paths_json,)
             )
 
             row = cursor.fetchone()
@@ -382,6 +599,52 @@ class Database:
             # Fallback: return first image if no records found
             return image_paths[0] if image_paths else None
 
+    def get_least_recently_viewed_under(
+        self,
+        directory: str,
+        image_paths: Container[str],
+    ) -> Optional[str]:
+        """Get the least recently viewed image below a directory.
+
+        Same ordering as get_least_recently_viewed, ranked in one query over
+        the primary key range of the directory's path prefix instead of a
+        bound IN list.  Rows are only accepted if they are in image_paths,
+        which filters out stale records (trashed or deleted files).
+
+        Args:
+            directory: Absolute directory path to search under
+            image_paths: Set of image paths currently on disk
+
+        Returns:
+            Path to least recently viewed image, or None if no synced
+            record under the directory is in image_paths
+        """
+        prefix = directory.rstrip(os.sep) + os.sep
+        # Smallest string greater than every path starting with prefix
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+
+        with self._get_connection() as conn:
+            # Unviewed rows first (oldest file_created_at first), then viewed
+            # rows by last_viewed_at; rows are fetched lazily, so stale
+            # records only cost a step each
+            cursor = conn.execute(
+                """
+                SELECT image_path
+                FROM image_metadata
+                WHERE image_path >= ? AND image_path < ?
+                ORDER BY last_viewed_at IS NOT NULL, last_viewed_at ASC,
+                    file_created_at ASC
+                """,
+                (prefix, upper)
+            )
+            try:
+                for row in cursor:
+                    if row['image_path'] in image_paths:
+                        return row['image_path']
+                return None
+            finally:
+                cursor.close()
+
     def get_random_image(self, image_paths: list[str]) -> Optional[str]:
         """Get a random image from the provided list.
 
@@ -389,6 +652,9 @@ class Database:
         If unviewed images exist, selects randomly from those.
         Otherwise, selects randomly from all images.
 
+        The unviewed pick counts the candidates and jumps to a random offset,
+        so no per-row random sort key is generated and sorted.
+
         Args:
             image_paths: List of image paths to consider
 
@@ -401,45 +667,38 @@ class Database:
         with self._get_connection() as conn:
             cursor = conn.cursor()
 
-            # Create placeholders for SQL IN clause
-            placeholders = ','.join('?' * len(image_paths))
+            # Bind the list as one JSON array: the statement text stays
+            # constant (statement cache hits) and there is no parameter limit
+            paths_json = json.dumps(image_paths)
 
-            # First, try to get a random unviewed image (last_viewed_at IS NULL)
             cursor.execute(
-                f"""
-                SELECT image_path
+                """
+                SELECT COUNT(*)
                 FROM image_metadata
-                WHERE image_path IN ({placeholders})
+                WHERE image_path IN (SELECT value FROM json_each(?))
                 AND last_viewed_at IS NULL
-                ORDER BY RANDOM()
-                LIMIT 1
                 """,
-                image_paths
+                (paths_json,)
             )
+            unviewed_count = cursor.fetchone()[0]
 
-            row = cursor.fetchone()
-            if row:
-                return row['image_path']
-
-            # No unviewed images - get a random image from all images
-            cursor.execute(
-                f"""
-                SELECT image_path
-                FROM image_metadata
-                WHERE image_path IN ({placeholders})
-                ORDER BY RANDOM()
-                LIMIT 1
-                """,
-                image_paths
-            )
-
-            row = cursor.fetchone()
-            if row:
-                return row['image_path']
+            if unviewed_count:
+                cursor.execute(
+                    """
+                    SELECT image_path
+                    FROM image_metadata
+                    WHERE image_path IN (SELECT value FROM json_each(?))
+                    AND last_viewed_at IS NULL
+                    LIMIT 1 OFFSET ?
+                    """,
+                    (paths_json, random.randrange(unviewed_count))
+                )
+                row = cursor.fetchone()
+                if row:
+                    return row['image_path']
 
-            # Fallback: return random image from list if no records found
-            import random
-            return random.choice(image_paths) if image_paths else None
+        # No unviewed images - the list is already in memory, so pick from it
+        return random.choice(image_paths)
 
     def delete_thumbnail_record(self, image_path: str):
         """Delete thumbnail record from database.
@@ -450,7 +709,7 @@ class Database:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM thumbnails WHERE image_path = ?", (image_path,))
-            conn.commit()
+            self._commit(conn)
 
     def delete_metadata_record(self, image_path: str):
         """Delete metadata record from database.
@@ -461,7 +720,7 @@ class Database:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM image_metadata WHERE image_path = ?", (image_path,))
-            conn.commit()
+            self._commit(conn)
 
     def update_image_path(self, old_path: str, new_path: str):
         """Update image path in all tables, preserving existing data.
@@ -493,7 +752,7 @@ class Database:
                 (new_path, old_path)
             )
 
-            conn.commit()
+            self._commit(conn)
 
     def add_to_trash(self, trash_path: str, original_path: str):
         """Record an image as trashed.
@@ -509,36 +768,49 @@ class Database:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                INSERT OR REPLACE INTO trash (trash_path, original_path, trashed_at)
+                INSERT INTO trash (trash_path, original_path, trashed_at)
                 VALUES (?, ?, ?)
+                ON CONFLICT(trash_path) DO UPDATE SET
+                    original_path = excluded.original_path,
+                    trashed_at = excluded.trashed_at
                 """,
                 (trash_path, original_path, time.time())
             )
-            conn.commit()
+            self._commit(conn)
 
-    def list_trashed_images(self) -> list[dict]:
-        """Get list of all trashed images.
+    def list_trashed_images(
+        self,
+        limit: Optional[int] = None,
+        before_ts: Optional[float] = None
+    ) -> list[dict]:
+        """Get trashed images, most recently trashed first.
+
+        With limit and before_ts this pages through the trash by keyset:
+        pass the trashed_at of the last item of one page as before_ts to
+        get the next.  idx_trashed_at serves both the filter and the order.
+
+        Args:
+            limit: Maximum number of items to return (None for all)
+            before_ts: Only return items trashed strictly before this time
 
         Returns:
             List of dicts with trash_path, original_path, and trashed_at
         """
         with self._get_connection() as conn:
             cursor = conn.cursor()
+            # LIMIT -1 means no limit in SQLite
             cursor.execute(
                 """
                 SELECT trash_path, original_path, trashed_at
                 FROM trash
+                WHERE ? IS NULL OR trashed_at < ?
                 ORDER BY trashed_at DESC
-                """
+                LIMIT ?
+                """,
+                (before_ts, before_ts, -1 if limit is None else limit)
             )
-            return [
-                {
-                    'trash_path': row['trash_path'],
-                    'original_path': row['original_path'],
-                    'trashed_at': row['trashed_at']
-                }
-                for row in cursor.fetchall()
-            ]
+            # Iterate the cursor directly rather than fetchall()ing first
+            return [dict(row) for row in cursor]
 
     def remove_from_trash(self, trash_path: str):
         """Remove an image record from trash table.
@@ -549,7 +821,7 @@ class Database:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM trash WHERE trash_path = ?", (trash_path,))
-            conn.commit()
+            self._commit(conn)
 
     def bulk_delete_trash(self, trash_paths: list[str]):
         """Delete all records associated with trashed images in a single transaction.
@@ -565,24 +837,20 @@ class Database:
 
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            # Chunk to stay under SQLite's parameter limit
-            chunk_size = 900
-            for i in range(0, len(trash_paths), chunk_size):
-                chunk = trash_paths[i:i + chunk_size]
-                placeholders = ','.join('?' * len(chunk))
-                cursor.execute(
-                    f"DELETE FROM thumbnails WHERE image_path IN ({placeholders})",
-                    chunk
-                )
-                cursor.execute(
-                    f"DELETE FROM image_metadata WHERE image_path IN ({placeholders})",
-                    chunk
-                )
-                cursor.execute(
-                    f"DELETE FROM trash WHERE trash_path IN ({placeholders})",
-                    chunk
-                )
-            conn.commit()
+            paths_json = json.dumps(trash_paths)
+            cursor.execute(
+                "DELETE FROM thumbnails WHERE image_path IN (SELECT value FROM json_each(?))",
+                (paths_json,)
+            )
+            cursor.execute(
+                "DELETE FROM image_metadata WHERE image_path IN (SELECT value FROM json_each(?))",
+                (paths_json,)
+            )
+            cursor.execute(
+                "DELETE FROM trash WHERE trash_path IN (SELECT value FROM json_each(?))",
+                (paths_json,)
+            )
+            self._commit(conn)
 
     def get_trash_item(self, trash_path: str) -> dict | None:
         """Get trash record for a specific image.
@@ -613,7 +881,7 @@ class Database:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM trash")
-            conn.commit()
+            self._commit(conn)
 
     def sync_trash_folder(self, trash_folder_path: str, gallery_root_path: str):
         """Sync trash folder with database, adding orphaned trash images.
@@ -625,107 +893,227 @@ class Database:
             trash_folder_path: Absolute path to trash folder
             gallery_root_path: Absolute path to gallery root
         """
-        from pathlib import Path
+        if not os.path.isdir(trash_folder_path):
+            return
 
-        trash_path = Path(trash_folder_path)
-        if not trash_path.exists():
+        # Resolve the roots once; os.walk doesn't follow directory symlinks,
+        # so every path joined below the resolved trash root is canonical
+        trash_root = os.path.realpath(trash_folder_path)
+        gallery_root = os.path.realpath(gallery_root_path)
+
+        # Walk before touching the database so no lock is held during I/O
+        from igallery.thumbnail_service import ThumbnailService
+
+        found = []
+        for root, dirs, files in os.walk(trash_root):
+            # The trash folder preserves the subfolder structure
+            rel_root = os.path.relpath(root, trash_root)
+            original_dir = gallery_root if rel_root == '.' else os.path.join(gallery_root, rel_root)
+            for file in files:
+                if ThumbnailService.is_image_file(file):
+                    found.append((os.path.join(root, file), os.path.join(original_dir, file)))
+
+        if not found:
             return
 
         with self._get_connection() as conn:
             cursor = conn.cursor()
-
-            # Get existing trash records from database
             cursor.execute("SELECT trash_path FROM trash")
             existing_trash_paths = {row['trash_path'] for row in cursor.fetchall()}
 
-            # Scan trash folder for all image files
-            from igallery.thumbnail_service import ThumbnailService
-
-            for root, dirs, files in __import__('os').walk(trash_path):
-                for file in files:
-                    file_path = Path(root) / file
-                    if ThumbnailService.is_image_file(str(file_path)):
-                        abs_trash_path = str(file_path.resolve())
-
-                        # Skip if already in database
-                        if abs_trash_path in existing_trash_paths:
-                            continue
-
-                        # Reconstruct original path
-                        # The trash folder preserves the subfolder structure
-                        try:
-                            rel_to_trash = file_path.relative_to(trash_path)
-                            original_path = str((Path(gallery_root_path) / rel_to_trash).resolve())
-                        except ValueError:
-                            # Fallback: use relative path as-is
-                            original_path = str((Path(gallery_root_path) / file_path.name).resolve())
-
-                        # Add to database with file mtime as trashed_at
-                        try:
-                            trashed_at = file_path.stat().st_mtime
-                        except (OSError, FileNotFoundError):
-                            trashed_at = time.time()
+        new_rows = []
+        for abs_trash_path, original_path in found:
+            if abs_trash_path in existing_trash_paths:
+                continue
+            # Use the file mtime as trashed_at
+            try:
+                trashed_at = os.stat(abs_trash_path).st_mtime
+            except OSError:
+                trashed_at = time.time()
+            new_rows.append((abs_trash_path, original_path, trashed_at))
 
-                        cursor.execute(
-                            """
-                            INSERT OR REPLACE INTO trash (trash_path, original_path, trashed_at)
-                            VALUES (?, ?, ?)
-                            """,
-                            (abs_trash_path, original_path, trashed_at)
-                        )
+        if not new_rows:
+            return
 
-            conn.commit()
+        # A record added by add_to_trash since the read above is more
+        # accurate than one reconstructed from the folder layout
+        with self._get_connection() as conn:
+            conn.executemany(
+                """
+                INSERT INTO trash (trash_path, original_path, trashed_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(trash_path) DO NOTHING
+                """,
+                new_rows
+            )
+            self._commit(conn)
 
-    def cleanup_orphaned_records(self, valid_image_paths: set[str], valid_trash_paths: set[str]):
-        """Remove database records for images that no longer exist on filesystem.
+    def compact(self):
+        """Checkpoint the WAL back into the database file and refresh planner stats.
 
-        Args:
-            valid_image_paths: Set of image paths that currently exist in gallery
-            valid_trash_paths: Set of image paths that currently exist in trash
+        Meant for periodic maintenance, after a batch of deletes.
         """
         with self._get_connection() as conn:
-            cursor = conn.cursor()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA optimize")
 
-            # Get all image paths in thumbnails table
-            cursor.execute("SELECT image_path FROM thumbnails")
-            thumbnail_paths = [row['image_path'] for row in cursor.fetchall()]
+    def cleanup_orphaned_records(self, valid_image_paths: Iterable[str], valid_trash_paths: Iterable[str]):
+        """Remove database records for images that no longer exist on filesystem.
 
-            # Get all image paths in metadata table
-            cursor.execute("SELECT image_path FROM image_metadata")
-            metadata_paths = [row['image_path'] for row in cursor.fetchall()]
+        The valid paths are loaded into a temp table and SQLite does the set
+        difference, so no table is read back into Python.
 
-            # Get all trash paths
-            cursor.execute("SELECT trash_path FROM trash")
-            trash_db_paths = [row['trash_path'] for row in cursor.fetchall()]
+        Both arguments are consumed once, straight into executemany.  A path
+        may appear in both; it then counts as a trash path.
 
-            # Delete orphaned thumbnail records (not in gallery or trash)
-            all_valid = valid_image_paths | valid_trash_paths
-            orphaned_thumbnails = [p for p in thumbnail_paths if p not in all_valid]
-            if orphaned_thumbnails:
-                placeholders = ','.join('?' * len(orphaned_thumbnails))
-                cursor.execute(
-                    f"DELETE FROM thumbnails WHERE image_path IN ({placeholders})",
-                    orphaned_thumbnails
+        Args:
+            valid_image_paths: Image paths that currently exist in gallery
+            valid_trash_paths: Image paths that currently exist in trash
+
+        Returns:
+            Tuple of (thumbnails, metadata, trash) record counts removed
+        """
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS _valid_paths (
+                    path TEXT PRIMARY KEY,
+                    in_trash INTEGER NOT NULL
+                )
+            """)
+            try:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO _valid_paths (path, in_trash) VALUES (?, 0)",
+                    ((path,) for path in valid_image_paths)
+                )
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO _valid_paths (path, in_trash) VALUES (?, 1)",
+                    ((path,) for path in valid_trash_paths)
                 )
 
-            # Delete orphaned metadata records (not in gallery or trash)
-            orphaned_metadata = [p for p in metadata_paths if p not in all_valid]
-            if orphaned_metadata:
-                placeholders = ','.join('?' * len(orphaned_metadata))
+                # Thumbnails and metadata are valid in the gallery or the trash
+                cursor.execute(
+                    "DELETE FROM thumbnails WHERE image_path NOT IN (SELECT path FROM _valid_paths)"
+                )
+                orphaned_thumbnails = cursor.rowcount
                 cursor.execute(
-                    f"DELETE FROM image_metadata WHERE image_path IN ({placeholders})",
-                    orphaned_metadata
+                    "DELETE FROM image_metadata WHERE image_path NOT IN (SELECT path FROM _valid_paths)"
                 )
+                orphaned_metadata = cursor.rowcount
 
-            # Delete orphaned trash records
-            orphaned_trash = [p for p in trash_db_paths if p not in valid_trash_paths]
-            if orphaned_trash:
-                placeholders = ','.join('?' * len(orphaned_trash))
+                # Trash records are only valid while the file is in the trash
                 cursor.execute(
-                    f"DELETE FROM trash WHERE trash_path IN ({placeholders})",
-                    orphaned_trash
+                    "DELETE FROM trash WHERE trash_path NOT IN "
+                    "(SELECT path FROM _valid_paths WHERE in_trash = 1)"
                 )
+                orphaned_trash = cursor.rowcount
+            finally:
+                cursor.execute("DELETE FROM _valid_paths")
 
-            conn.commit()
+            return orphaned_thumbnails, orphaned_metadata, orphaned_trash
 
-            return len(orphaned_thumbnails), len(orphaned_metadata), len(orphaned_trash)
+    @staticmethod
+    def _direct_children_range(dir_path: str) -> Tuple[str, str, int]:
+        """Key range and name offset for paths directly inside dir_path.
+
+        Returns:
+            Tuple of (lower bound, upper bound, 1-based offset of the name
+            after the prefix) for use with substr()
+        """
+        prefix = dir_path.rstrip(os.sep) + os.sep
+        # Smallest string greater than every path starting with prefix
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1), len(prefix) + 1
+
+    def get_directory_index_entry(self, dir_path: str) -> Optional[Tuple[int, list[str]]]:
+        """Look up one directory of the index used by incremental gallery scans.
+
+        Args:
+            dir_path: Absolute directory path
+
+        Returns:
+            Tuple of (mtime_ns, names of its indexed subdirectories), or
+            None if the directory is not indexed
+        """
+        lower, upper, name_start = self._direct_children_range(dir_path)
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT mtime_ns FROM directory_index WHERE dir_path = ?", (dir_path,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                """
+                SELECT substr(dir_path, ?) FROM directory_index
+                WHERE dir_path >= ? AND dir_path < ?
+                AND instr(substr(dir_path, ?), ?) = 0
+                """,
+                (name_start, lower, upper, name_start, os.sep)
+            )
+            return row[0], [child[0] for child in cursor.fetchall()]
+
+    def get_tracked_paths_in_dir(self, dir_path: str) -> list[str]:
+        """Get every path directly in a directory that any table has a record for.
+
+        Args:
+            dir_path: Absolute directory path
+
+        Returns:
+            Paths from image_metadata, thumbnails and trash, without duplicates
+        """
+        lower, upper, name_start = self._direct_children_range(dir_path)
+        params = (lower, upper, name_start, os.sep)
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            # Each branch is a primary key range search
+            cursor.execute(
+                """
+                SELECT image_path FROM image_metadata
+                WHERE image_path >= ? AND image_path < ? AND instr(substr(image_path, ?), ?) = 0
+                UNION
+                SELECT image_path FROM thumbnails
+                WHERE image_path >= ? AND image_path < ? AND instr(substr(image_path, ?), ?) = 0
+                UNION
+                SELECT trash_path FROM trash
+                WHERE trash_path >= ? AND trash_path < ? AND instr(substr(trash_path, ?), ?) = 0
+                """,
+                params * 3
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def update_directory_index(
+        self,
+        entries: list[Tuple[str, int]],
+        removed_dirs: list[str],
+        known_dirs: Iterable[str] = ()
+    ):
+        """Store rescanned directories and drop directories that disappeared.
+
+        Args:
+            entries: List of (dir_path, mtime_ns) for directories just listed
+            removed_dirs: Directories that no longer exist; their whole
+                subtree is removed from the index
+            known_dirs: Directories seen in a listing; those not indexed yet
+                are added with UNTRUSTED_MTIME_NS, so the next scan lists them
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            for dir_path in removed_dirs:
+                prefix = dir_path + os.sep
+                cursor.execute(
+                    "DELETE FROM directory_index WHERE dir_path = ? OR (dir_path >= ? AND dir_path < ?)",
+                    (dir_path, prefix, dir_path + chr(ord(os.sep) + 1))
+                )
+            cursor.executemany(
+                "INSERT INTO directory_index (dir_path, mtime_ns) VALUES (?, ?) "
+                "ON CONFLICT(dir_path) DO NOTHING",
+                ((dir_path, self.UNTRUSTED_MTIME_NS) for dir_path in known_dirs)
+            )
+            cursor.executemany(
+                """
+                INSERT INTO directory_index (dir_path, mtime_ns)
+                VALUES (?, ?)
+                ON CONFLICT(dir_path) DO UPDATE SET mtime_ns = excluded.mtime_ns
+                """,
+                entries
+            )
+            self._commit(conn)
@@ -1,12 +1,88 @@
 """File operations for image gallery."""
 
+import errno
+import functools
 import os
 import shutil
+import time
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from igallery.thumbnail_service import ThumbnailService
 
+# Directory mtimes come from a coarse kernel clock, so an entry added in
+# the same tick as a scan can leave the mtime unchanged.  Listings of
+# directories modified this recently are not cached.
+_RACY_MTIME_NS = 2_000_000_000
+
+
+@functools.lru_cache(maxsize=64)
+def _resolve_root(gallery_root: str) -> Path:
+    """Resolve a gallery root once per process.
+
+    Roots are fixed at startup (the app's roots registry resolves them once
+    too), so repeating realpath's per-component lstat walk on every
+    FileOperations construction buys nothing.
+    """
+    return Path(gallery_root).resolve()
+
+
+def move_file(src: str, dst: str):
+    """Move a file with a single rename, copying only across filesystems.
+
+    Args:
+        src: Existing file path
+        dst: Destination file path
+    """
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def _scan_directory(directory: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """List a directory's images and visible subdirectories in one pass.
+
+    DirEntry.is_file()/is_dir() answer from the dirent type, so only
+    symlinks cost a stat (Path.iterdir() stats every entry).
+
+    Args:
+        directory: Directory to scan
+
+    Returns:
+        Tuple of (sorted image file paths, sorted subdirectory names)
+
+    Raises:
+        OSError: If the directory can't be read
+    """
+    images = []
+    subdirs = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            name = entry.name
+            if entry.is_file():
+                if ThumbnailService.is_image_file(name):
+                    images.append(entry.path)
+            elif name[:1] != '.' and name != 'trash' and entry.is_dir():
+                subdirs.append(name)
+
+    images.sort()
+    subdirs.sort()
+    return tuple(images), tuple(subdirs)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_scan(directory: str, mtime_ns: int, size: int) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """_scan_directory memoized on the directory's (mtime_ns, size).
+
+    Adding, removing or renaming an entry changes the directory's mtime,
+    so a changed key means a changed listing; superseded keys age out of
+    the LRU.  Results are tuples so cached listings can't be mutated.
+    """
+    return _scan_directory(directory)
+
 
 class FileOperations:
     """Manages file system operations for the gallery."""
@@ -19,7 +95,42 @@ class FileOperations:
             gallery_root: Root directory of the gallery (for trash location)
         """
         self.current_dir = Path(current_dir).resolve()
-        self.gallery_root = Path(gallery_root).resolve() if gallery_root else self.current_dir
+        self.gallery_root = _resolve_root(str(gallery_root)) if gallery_root else self.current_dir
+
+    @staticmethod
+    def _scan(
+        directory, mtimes: Optional[Dict[str, int]] = None
+    ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """List a directory's images and visible subdirectories.
+
+        Listings are cached per directory and reused while its mtime and
+        size are unchanged, so paging through a folder scans it once.
+
+        Args:
+            directory: Directory to scan
+            mtimes: If given, receives the directory's st_mtime_ns as
+                stat'd before listing it (nothing if the stat fails)
+
+        Returns:
+            Tuple of (sorted image file paths, sorted subdirectory names);
+            both empty if the directory can't be read
+        """
+        directory = os.fspath(directory)
+        try:
+            st = os.stat(directory)
+            if mtimes is not None:
+                mtimes[directory] = st.st_mtime_ns
+            if time.time_ns() - st.st_mtime_ns < _RACY_MTIME_NS:
+                return _scan_directory(directory)
+            return _cached_scan(directory, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return (), ()
+
+    def _scan_current(
+        self, mtimes: Optional[Dict[str, int]] = None
+    ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """Scan the current directory; see _scan."""
+        return self._scan(self.current_dir, mtimes)
 
     def list_images(self) -> List[str]:
         """List all images in current directory.
@@ -27,15 +138,7 @@ class FileOperations:
         Returns:
             Sorted list of image file paths
         """
-        images = []
-        try:
-            for entry in self.current_dir.iterdir():
-                if entry.is_file() and ThumbnailService.is_image_file(str(entry)):
-                    images.append(str(entry))
-        except (PermissionError, FileNotFoundError, OSError):
-            pass
-
-        return sorted(images)
+        return list(self._scan_current()[0])
 
     def list_subdirectories(self) -> List[str]:
         """List all subdirectories in current directory.
@@ -43,15 +146,7 @@ class FileOperations:
         Returns:
             Sorted list of subdirectory names (relative)
         """
-        subdirs = []
-        try:
-            for entry in self.current_dir.iterdir():
-                if entry.is_dir() and not entry.name.startswith('.') and entry.name != 'trash':
-                    subdirs.append(entry.name)
-        except (PermissionError, FileNotFoundError, OSError):
-            pass
-
-        return sorted(subdirs)
+        return list(self._scan_current()[1])
 
     def navigate_to(self, path: str) -> 'FileOperations':
         """Navigate to a subdirectory or parent.
@@ -106,7 +201,7 @@ class FileOperations:
                 target_path = base_dir / f"{stem}_{counter}{suffix}"
                 counter += 1
 
-        shutil.move(str(image_path), str(target_path))
+        move_file(str(image_path), str(target_path))
         return str(target_path)
 
     def get_image_path(self, image_name: str) -> str:
@@ -130,7 +225,7 @@ class FileOperations:
         Returns:
             Tuple of (list of image paths for page, total number of pages)
         """
-        images = self.list_images()
+        images = self._scan_current()[0]
         total_images = len(images)
 
         if total_images == 0:
@@ -145,9 +240,14 @@ class FileOperations:
         start_idx = (page - 1) * per_page
         end_idx = start_idx + per_page
 
-        return images[start_idx:end_idx], total_pages
+        return list(images[start_idx:end_idx]), total_pages
 
-    def get_page_with_directories(self, page: int, per_page: int = 20) -> Tuple[List[dict], int]:
+    def get_page_with_directories(
+        self,
+        page: int,
+        per_page: int = 20,
+        dir_mtimes: Optional[Dict[str, int]] = None,
+    ) -> Tuple[List[dict], int]:
         """Get paginated list of directories and images combined.
 
         Directories appear first, followed by images.
@@ -155,6 +255,9 @@ class FileOperations:
         Args:
             page: Page number (1-indexed)
             per_page: Number of items per page
+            dir_mtimes: If given, receives the st_mtime_ns of the current
+                directory and of each directory on the page, each taken
+                before that directory was listed
 
         Returns:
             Tuple of (list of items with type indicators, total number of pages)
@@ -164,38 +267,11 @@ class FileOperations:
                 - 'path': full path (for images)
                 - 'first_image': first image filename in directory (for directories only)
         """
-        # Single-pass directory listing instead of two separate iterdir calls
-        subdirs = []
-        images = []
-        try:
-            for entry in self.current_dir.iterdir():
-                if entry.is_dir() and not entry.name.startswith('.') and entry.name != 'trash':
-                    subdirs.append(entry.name)
-                elif entry.is_file() and ThumbnailService.is_image_file(str(entry)):
-                    images.append(str(entry))
-        except (PermissionError, FileNotFoundError, OSError):
-            pass
-
-        subdirs.sort()
-        images.sort()
-
-        # Build combined list: directories first (without preview), then images
-        items = []
-        for subdir in subdirs:
-            items.append({
-                'type': 'directory',
-                'name': subdir,
-                'first_image': None,
-                'item_count': 0,
-            })
-        for image_path in images:
-            items.append({
-                'type': 'image',
-                'name': Path(image_path).name,
-                'path': image_path
-            })
+        images, subdirs = self._scan_current(dir_mtimes)
 
-        total_items = len(items)
+        # Directories occupy item positions [0, len(subdirs)), images follow;
+        # only the dicts for the requested page are built
+        total_items = len(subdirs) + len(images)
 
         if total_items == 0:
             return [], 0
@@ -208,25 +284,30 @@ class FileOperations:
 
         start_idx = (page - 1) * per_page
         end_idx = start_idx + per_page
-        page_items = items[start_idx:end_idx]
-
-        # Only scan subdirectory contents for items in the current page
-        for item in page_items:
-            if item['type'] == 'directory':
-                subdir_path = self.current_dir / item['name']
-                try:
-                    images_in_subdir = []
-                    subdirs_in_subdir = 0
-                    for entry in subdir_path.iterdir():
-                        if entry.is_file() and ThumbnailService.is_image_file(str(entry)):
-                            images_in_subdir.append(entry.name)
-                        elif entry.is_dir() and not entry.name.startswith('.') and entry.name != 'trash':
-                            subdirs_in_subdir += 1
-                    if images_in_subdir:
-                        item['first_image'] = sorted(images_in_subdir)[0]
-                    item['item_count'] = len(images_in_subdir) + subdirs_in_subdir
-                except (PermissionError, FileNotFoundError, OSError):
-                    pass
+        dir_count = len(subdirs)
+
+        page_items = []
+        for subdir in subdirs[start_idx:end_idx]:
+            # Preview scans only happen for directories shown on this page
+            images_in_subdir, subdirs_in_subdir = self._scan(
+                os.path.join(self.current_dir, subdir), dir_mtimes
+            )
+            page_items.append({
+                'type': 'directory',
+                'name': subdir,
+                'first_image': os.path.basename(images_in_subdir[0]) if images_in_subdir else None,
+                'item_count': len(images_in_subdir) + len(subdirs_in_subdir),
+            })
+
+        # Every scanned path is current_dir joined with the entry name, so
+        # slice the name off instead of building a Path per image
+        name_start = len(os.path.join(self.current_dir, ''))
+        for image_path in images[max(start_idx - dir_count, 0):max(end_idx - dir_count, 0)]:
+            page_items.append({
+                'type': 'image',
+                'name': image_path[name_start:],
+                'path': image_path
+            })
 
         return page_items, total_pages
 
@@ -291,5 +372,5 @@ class FileOperations:
                 counter += 1
 
         # Move the file
-        shutil.move(str(image_path), str(target_path))
+        move_file(str(image_path), str(target_path))
         return str(target_path), True
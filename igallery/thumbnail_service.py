@@ -3,7 +3,7 @@
 import io
 import os
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 
 from PIL import Image
 
@@ -13,7 +13,7 @@ from igallery.database import Database
 class ThumbnailService:
     """Manages thumbnail generation and caching."""
 
-    SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+    SUPPORTED_FORMATS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'})
 
     def __init__(self, db: Database):
         """Initialize thumbnail service.
@@ -26,23 +26,27 @@ class ThumbnailService:
     def get_or_create_thumbnail(
         self,
         image_path: str,
-        size: Tuple[int, int] = (100, 100)
+        size: Tuple[int, int] = (100, 100),
+        stat_result: Optional[os.stat_result] = None
     ) -> bytes:
         """Get cached thumbnail or create new one.
 
         Args:
             image_path: Path to the original image
             size: Maximum dimensions for thumbnail (width, height)
+            stat_result: os.stat() of image_path if the caller already has
+                it, saving a second stat
 
         Returns:
             Thumbnail image data as bytes
         """
         image_path = str(Path(image_path).resolve())
-        stat = os.stat(image_path)
-        image_mtime = stat.st_mtime
+        stat = stat_result if stat_result is not None else os.stat(image_path)
+        # Integer nanoseconds compare exactly, unlike float st_mtime
+        image_mtime_ns = stat.st_mtime_ns
 
         # Check cache
-        cached_thumbnail = self.db.get_thumbnail(image_path, image_mtime)
+        cached_thumbnail = self.db.get_thumbnail(image_path, image_mtime_ns)
         if cached_thumbnail:
             return cached_thumbnail
 
@@ -53,7 +57,7 @@ class ThumbnailService:
         self.db.save_thumbnail(
             image_path,
             thumbnail_data,
-            image_mtime,
+            image_mtime_ns,
             stat.st_size
         )
 
@@ -103,4 +107,6 @@ class ThumbnailService:
         Returns:
             True if file is a supported image format
         """
-        return Path(file_path).suffix.lower() in ThumbnailService.SUPPORTED_FORMATS
+        # splitext matches Path.suffix here (".jpg" alone has no extension)
+        # without allocating a Path per call
+        return os.path.splitext(file_path)[1].lower() in ThumbnailService.SUPPORTED_FORMATS
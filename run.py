@@ -22,7 +22,7 @@ def main():
     if not marker_file.exists():
         print("Installing dependencies with uv...")
         subprocess.run(
-            ["uv", "pip", "install", "flask", "pillow", "pytest", "pytest-cov"],
+            ["uv", "pip", "install", "flask", "pillow", "pytest", "pytest-cov", "waitress"],
             cwd=project_root,
             check=True
         )
@@ -1,12 +1,21 @@
 """Tests for Flask web application."""
 
+import gc
 import json
+import os
+import shutil
 import tempfile
+import time
+import weakref
 from pathlib import Path
 import pytest
 from PIL import Image
+from werkzeug.test import EnvironBuilder
 
-from igallery.app import create_app
+from igallery.app import (
+    create_app, _collect_all_image_paths_in_dir, _DirectoryImageCache, _ViewRecorder,
+)
+from igallery.database import Database
 
 
 @pytest.fixture
@@ -48,6 +57,19 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def db(app):
+    """Return the gallery database the app writes to."""
+    return app.config['GALLERY_ROOTS'][0]['db']
+
+
+def _age_dirs(root, seconds=10):
+    """Backdate the mtime of root and every directory below it."""
+    past_ns = time.time_ns() - seconds * 1_000_000_000
+    for dir_path, _, _ in os.walk(root):
+        os.utime(dir_path, ns=(past_ns, past_ns))
+
+
 class TestWebRoutes:
     """Test web application routes."""
 
@@ -57,6 +79,45 @@ class TestWebRoutes:
         assert response.status_code == 200
         assert b'image' in response.data
 
+    def test_index_cache_follows_directory_changes(self, client, temp_gallery):
+        """Test that cached index pages refresh when listed dirs change."""
+        def fetch():
+            response = client.get('/?fetch_images_only=true&per_page=100')
+            assert response.content_type == 'application/json'
+            return {item['name']: item for item in json.loads(response.data)['items']}
+
+        def touch(directory):
+            st = os.stat(directory)
+            os.utime(directory, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+        # Outside the racy window, so the first page is cached
+        _age_dirs(temp_gallery)
+        assert fetch()['vacation']['item_count'] == 5
+
+        Image.new('RGB', (10, 10)).save(temp_gallery / "vacation" / "new.jpg", 'JPEG')
+        touch(temp_gallery / "vacation")
+        assert fetch()['vacation']['item_count'] == 6
+
+        Image.new('RGB', (10, 10)).save(temp_gallery / "fresh.jpg", 'JPEG')
+        touch(temp_gallery)
+        assert 'fresh.jpg' in fetch()
+
+    def test_index_cache_skips_racy_directories(self, client, temp_gallery):
+        """Test that a page listing a just-modified directory is not cached."""
+        def vacation_count():
+            response = client.get('/?fetch_images_only=true&per_page=100')
+            items = json.loads(response.data)['items']
+            return next(i for i in items if i['name'] == 'vacation')['item_count']
+
+        vacation = temp_gallery / "vacation"
+        st = os.stat(vacation)
+        assert vacation_count() == 5
+
+        # A file landing in the same mtime tick as the listing
+        Image.new('RGB', (10, 10)).save(vacation / "late.jpg", 'JPEG')
+        os.utime(vacation, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert vacation_count() == 6
+
     def test_pagination_first_page(self, client):
         """Test pagination on first page."""
         response = client.get('/?page=1')
@@ -81,6 +142,37 @@ class TestWebRoutes:
             assert response.status_code == 200
             assert response.content_type.startswith('image/')
 
+    def test_thumbnail_revalidation(self, client):
+        """Test that thumbnails carry validators and answer 304 when unchanged."""
+        response = client.get('/thumbnail/image00.jpg')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        assert 'no-store' not in response.headers['Cache-Control']
+
+        response = client.get('/thumbnail/image00.jpg', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        response = client.get('/thumbnail/image00.jpg', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+
+        # A non-matching ETag wins over a still-valid If-Modified-Since
+        response = client.get('/thumbnail/image00.jpg',
+                              headers={'If-None-Match': '"stale"', 'If-Modified-Since': last_modified})
+        assert response.status_code == 200
+
+    def test_trash_thumbnail_revalidation(self, client):
+        """Test that trash thumbnails share the same conditional handling."""
+        client.post('/trash', data=json.dumps({'image_name': 'image00.jpg'}),
+                    content_type='application/json')
+
+        response = client.get('/trash/thumbnail/image00.jpg')
+        assert response.status_code == 200
+
+        response = client.get('/trash/thumbnail/image00.jpg',
+                              headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+
     def test_carousel_page(self, client):
         """Test carousel page loads."""
         response = client.get('/carousel')
@@ -193,6 +285,65 @@ class TestWebRoutes:
         assert (temp_gallery / image_name).exists()
         assert not trash_full_path.exists()
 
+    def test_restore_recreates_missing_folder(self, client, temp_gallery):
+        """Test restoring into a folder that was removed after trashing."""
+        response = client.post('/trash', data=json.dumps({'image_name': 'vacation/vacation0.jpg'}),
+                               content_type='application/json')
+        assert response.status_code == 200
+        shutil.rmtree(temp_gallery / "vacation")
+
+        response = client.post('/trash/restore', data=json.dumps({'trash_path': 'vacation/vacation0.jpg'}),
+                               content_type='application/json')
+        assert response.status_code == 200
+        assert (temp_gallery / "vacation" / "vacation0.jpg").exists()
+        # The emptied trash subfolder is pruned, trash/ itself is kept
+        assert not (temp_gallery / "trash" / "vacation").exists()
+        assert (temp_gallery / "trash").is_dir()
+
+        # The trash record is gone now, and so is the file
+        response = client.post('/trash/restore', data=json.dumps({'trash_path': 'vacation/vacation0.jpg'}),
+                               content_type='application/json')
+        assert response.status_code == 404
+
+    def test_trash_view_shows_relative_paths(self, client):
+        """Test that nested trash items are listed relative to trash/."""
+        response = client.post('/trash', data=json.dumps({'image_name': 'vacation/vacation0.jpg'}),
+                               content_type='application/json')
+        assert response.status_code == 200
+
+        response = client.get('/trash-view')
+        assert response.status_code == 200
+        assert b'/trash/thumbnail/vacation/vacation0.jpg' in response.data
+
+    def test_delete_all_trash_empties_nested_tree(self, client, temp_gallery):
+        """Test that delete-all removes nested trash dirs and keeps trash/."""
+        for name in ['image00.jpg', 'vacation/vacation0.jpg']:
+            response = client.post('/trash', data=json.dumps({'image_name': name}),
+                                   content_type='application/json')
+            assert response.status_code == 200
+
+        response = client.post('/trash/delete-all')
+        assert response.status_code == 200
+        assert json.loads(response.data)['deleted'] == 2
+
+        trash_dir = temp_gallery / "trash"
+        assert trash_dir.is_dir()
+        assert list(trash_dir.iterdir()) == []
+
+    def test_delete_all_trash_keeps_untracked_files(self, client, temp_gallery):
+        """Test that delete-all only removes files the trash records list."""
+        response = client.post('/trash', data=json.dumps({'image_name': 'vacation/vacation0.jpg'}),
+                               content_type='application/json')
+        assert response.status_code == 200
+        untracked = temp_gallery / "trash" / "notes.txt"
+        untracked.write_text("keep me")
+
+        response = client.post('/trash/delete-all')
+        assert json.loads(response.data)['deleted'] == 1
+
+        assert untracked.exists()
+        assert not (temp_gallery / "trash" / "vacation").exists()
+
     def test_restore_nonexistent_image(self, client):
         """Test restoring an image that doesn't exist in trash."""
         response = client.post(
@@ -211,6 +362,14 @@ class TestWebRoutes:
             assert response.status_code == 200
             assert response.content_type.startswith('image/')
 
+    def test_full_image_x_sendfile(self, app, client, temp_gallery):
+        """Test that USE_X_SENDFILE hands the file off to the front-end server."""
+        app.config['USE_X_SENDFILE'] = True
+        response = client.get('/image/image00.jpg')
+        assert response.status_code == 200
+        assert response.headers['X-Sendfile'] == str((temp_gallery / "image00.jpg").resolve())
+        assert response.data == b''
+
     def test_invalid_image_404(self, client):
         """Test that invalid image returns 404."""
         response = client.get('/image/nonexistent.jpg')
@@ -301,6 +460,39 @@ class TestWebRoutes:
             response = client.get(path)
             assert response.status_code in [400, 403, 404]
 
+    def test_sibling_directory_with_shared_prefix_blocked(self, client, temp_gallery):
+        """Test that a sibling dir sharing the root's name prefix is rejected."""
+        sibling = temp_gallery.parent / (temp_gallery.name + "_evil")
+        sibling.mkdir()
+        Image.new('RGB', (10, 10)).save(sibling / "secret.jpg", 'JPEG')
+
+        response = client.get(f'/image/../{sibling.name}/secret.jpg')
+        assert response.status_code == 403
+
+    def test_trash_rejects_image_name_traversal(self, client, temp_gallery):
+        """Test that image_name cannot point the trash move outside the gallery."""
+        outside = temp_gallery.parent / "outside.jpg"
+        Image.new('RGB', (10, 10)).save(outside, 'JPEG')
+
+        for name in ['../outside.jpg', str(outside)]:
+            response = client.post('/trash', data=json.dumps({'image_name': name}),
+                                   content_type='application/json')
+            assert response.status_code == 403
+        assert outside.exists()
+
+    def test_trash_routes_reject_traversal(self, app, temp_gallery):
+        """Test that raw '..' segments cannot escape the trash folder."""
+        (temp_gallery / "trash").mkdir()
+        Image.new('RGB', (10, 10)).save(temp_gallery.parent / "secret.jpg", 'JPEG')
+
+        for route in ('/trash/image', '/trash/thumbnail'):
+            # Set PATH_INFO directly; the test client would normalize '..'
+            environ = EnvironBuilder(path='/').get_environ()
+            environ['PATH_INFO'] = f'{route}/../../{temp_gallery.name}/../secret.jpg'
+            with app.request_context(environ):
+                response = app.full_dispatch_request()
+            assert response.status_code == 404
+
     def test_carousel_with_subdirectory_context(self, client):
         """Test that carousel respects subdirectory context."""
         # Request carousel from vacation subdirectory
@@ -419,3 +611,240 @@ class TestWebRoutes:
             # Second image should still be accessible (would have been preloaded)
             response = client.get(f'/image/{second_image}')
             assert response.status_code == 200
+
+
+class TestImagePathCollection:
+    """Test the recursive gallery image scan."""
+
+    def test_collects_nested_images_and_skips_excluded(self, temp_gallery):
+        """Test that nested images are found and excluded dirs are skipped."""
+        trash_dir = temp_gallery / "trash"
+        trash_dir.mkdir()
+        Image.new('RGB', (10, 10)).save(trash_dir / "trashed.jpg", 'JPEG')
+        (temp_gallery / "notes.txt").write_text("not an image")
+
+        images = _collect_all_image_paths_in_dir(temp_gallery, exclude_dirs={'trash'})
+
+        assert len(images) == 30
+        assert str((temp_gallery / "vacation" / "vacation0.jpg").resolve()) in images
+        assert not any('trashed.jpg' in p for p in images)
+
+    def test_paths_are_canonical(self, temp_gallery):
+        """Test that symlinked roots and files are reported by real path."""
+        link_root = temp_gallery.parent / "gallery_link"
+        link_root.symlink_to(temp_gallery, target_is_directory=True)
+        (temp_gallery / "vacation" / "alias.jpg").symlink_to(temp_gallery / "image00.jpg")
+
+        images = _collect_all_image_paths_in_dir(link_root)
+
+        real_root = str(temp_gallery.resolve())
+        assert all(p.startswith(real_root) for p in images)
+        assert not any(p.endswith('alias.jpg') for p in images)
+        assert str((temp_gallery / "image00.jpg").resolve()) in images
+
+    def test_directory_index_picks_up_changes(self, temp_gallery, db):
+        """Test that an indexed rescan sees added files and removed dirs."""
+        nested = temp_gallery / "vacation" / "day1"
+        nested.mkdir()
+        Image.new('RGB', (10, 10)).save(nested / "beach.jpg", 'JPEG')
+        # Age the tree past the racy window so the scan indexes it
+        _age_dirs(temp_gallery)
+
+        first = _collect_all_image_paths_in_dir(temp_gallery, db=db)
+        assert first == _collect_all_image_paths_in_dir(temp_gallery)
+        assert db.get_directory_index_entry(str(nested.resolve())) is not None
+        # Unchanged directories report the images the database tracks
+        db.sync_images(first)
+
+        new_image = temp_gallery / "vacation" / "added.jpg"
+        Image.new('RGB', (10, 10)).save(new_image, 'JPEG')
+        shutil.rmtree(nested)
+        # Make sure the mtime change is visible on coarse-grained filesystems
+        vacation = temp_gallery / "vacation"
+        st = os.stat(vacation)
+        os.utime(vacation, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+        second = _collect_all_image_paths_in_dir(temp_gallery, db=db)
+
+        beach = str((nested / "beach.jpg").resolve())
+        assert second == (first - {beach}) | {str(new_image.resolve())}
+        assert db.get_directory_index_entry(str(nested.resolve())) is None
+
+    def test_directory_index_skips_racy_mtimes(self, temp_gallery, db):
+        """Test that a directory modified within the racy window is not trusted."""
+        _collect_all_image_paths_in_dir(temp_gallery, db=db)
+        entry = db.get_directory_index_entry(str(temp_gallery.resolve()))
+        assert entry[0] == Database.UNTRUSTED_MTIME_NS
+
+        # A file landing in the same mtime tick as the first scan
+        vacation = temp_gallery / "vacation"
+        st = os.stat(vacation)
+        late = vacation / "late.jpg"
+        Image.new('RGB', (10, 10)).save(late, 'JPEG')
+        os.utime(vacation, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        images = _collect_all_image_paths_in_dir(temp_gallery, db=db)
+        assert str(late.resolve()) in images
+
+    def test_directory_index_finds_excluded_subdirs_later(self, temp_gallery, db):
+        """Test that a dir skipped by exclude_dirs is scanned by a later full walk."""
+        trash_dir = temp_gallery / "trash"
+        trash_dir.mkdir()
+        trashed = trash_dir / "trashed.jpg"
+        Image.new('RGB', (10, 10)).save(trashed, 'JPEG')
+        _age_dirs(temp_gallery)
+
+        _collect_all_image_paths_in_dir(temp_gallery, exclude_dirs={'trash'}, db=db)
+
+        assert str(trashed.resolve()) in _collect_all_image_paths_in_dir(temp_gallery, db=db)
+
+
+class TestDirectoryImageCache:
+    """Test the carousel's cached directory listing."""
+
+    def test_add_image_patches_cached_listing(self, temp_gallery):
+        """Test that a restored image shows up without waiting for a re-walk."""
+        cache = _DirectoryImageCache(debounce_seconds=60)
+        image_path = temp_gallery / "vacation" / "vacation0.jpg"
+        resolved = str(image_path.resolve())
+
+        assert resolved in cache.get_images(temp_gallery, exclude_dirs={'trash'})
+
+        cache.remove_image(resolved)
+        assert resolved not in cache.get_images(temp_gallery, exclude_dirs={'trash'})
+
+        cache.add_image(resolved)
+        assert resolved in cache.get_images(temp_gallery, exclude_dirs={'trash'})
+
+    def test_idle_listings_are_evicted(self, temp_gallery):
+        """Test that a listing unused past max_idle is dropped on the next walk."""
+        cache = _DirectoryImageCache(max_idle_seconds=0.05)
+        cache.get_images(temp_gallery / "vacation")
+        time.sleep(0.1)
+        cache.get_images(temp_gallery)
+
+        assert list(cache._cache) == [(str(temp_gallery.resolve()), frozenset())]
+
+    def test_walk_matches_scan_and_tracks_dirs(self, temp_gallery):
+        """Test that the cache walk lists nested images and records every dir."""
+        trash_dir = temp_gallery / "trash"
+        trash_dir.mkdir()
+        Image.new('RGB', (10, 10)).save(trash_dir / "trashed.jpg", 'JPEG')
+        # Several top-level subtrees so the walk fans out to the scan pool
+        nested = temp_gallery / "work" / "2024"
+        nested.mkdir(parents=True)
+        Image.new('RGB', (10, 10)).save(nested / "office.jpg", 'JPEG')
+
+        images, dir_mtimes = _DirectoryImageCache._walk(str(temp_gallery.resolve()), {'trash'})
+
+        assert images == _collect_all_image_paths_in_dir(temp_gallery, exclude_dirs={'trash'})
+        assert str((nested / "office.jpg").resolve()) in images
+        assert set(dir_mtimes) == {
+            str(d.resolve()) for d in (temp_gallery, temp_gallery / "vacation", temp_gallery / "work", nested)
+        }
+
+
+class TestViewRecorder:
+    """Test background view recording."""
+
+    def test_flush_writes_queued_views(self, db):
+        """Test that flush() persists views queued on the background writer."""
+        images = ["/img1.jpg", "/img2.jpg"]
+        db.sync_images(images)
+
+        recorder = _ViewRecorder()
+        recorder.record(db, images[1])
+        recorder.record(db, images[0])
+        recorder.flush()
+
+        assert db.get_least_recently_viewed(images) == images[1]
+
+    def test_back_to_back_repeat_views_are_dropped(self, db):
+        """Test that only consecutive repeats inside the window are skipped."""
+        images = ["/img1.jpg", "/img2.jpg"]
+        db.sync_images(images)
+
+        recorder = _ViewRecorder()
+        recorder.record(db, images[0])
+        recorder.record(db, images[1])
+        recorder.flush()
+        # Alternating views are all kept: img1 is re-recorded after img2
+        recorder.record(db, images[0])
+        recorder.flush()
+        assert db.get_least_recently_viewed(images) == images[1]
+
+        recorder.record(db, images[1])
+        first = recorder._last_view[db]
+        recorder.record(db, images[1])
+        assert recorder._last_view[db] is first
+        recorder.flush()
+
+    def test_idle_worker_exits_and_recorder_is_collectable(self, db):
+        """Test that an idle recorder holds no thread and no exit-hook reference."""
+        db.sync_images(["/img1.jpg"])
+
+        recorder = _ViewRecorder(idle_timeout=0.05, flush_interval=0.05)
+        recorder.record(db, "/img1.jpg")
+        worker = recorder._worker
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+        assert recorder._worker is None
+        assert db.get_least_recently_viewed(["/img1.jpg"]) == "/img1.jpg"
+
+        ref = weakref.ref(recorder)
+        del recorder, worker
+        gc.collect()
+        assert ref() is None
+
+    def test_record_now_writes_without_the_worker(self, db):
+        """Test that record_now() is visible immediately and starts no thread."""
+        images = ["/img1.jpg", "/img2.jpg"]
+        db.sync_images(images)
+
+        recorder = _ViewRecorder()
+        recorder.record_now(db, images[0])
+
+        assert recorder._worker is None
+        assert db.get_least_recently_viewed(images) == images[1]
+
+
+class TestStartupCleanup:
+    """Test the background orphan cleanup."""
+
+    def test_cleanup_starts_at_creation(self, temp_gallery):
+        """Test that start_cleanup runs the cleanup without waiting for a request."""
+        db_path = str(temp_gallery / "test.db")
+        orphan = str(temp_gallery / "trash" / "deleted.jpg")
+        Database(db_path).add_to_trash(orphan, str(temp_gallery / "deleted.jpg"))
+        (temp_gallery / "trash").mkdir()
+        kept = temp_gallery / "trash" / "image00.jpg"
+        (temp_gallery / "image00.jpg").rename(kept)
+        Database(db_path).add_to_trash(str(kept.resolve()), str(temp_gallery / "image00.jpg"))
+
+        app = create_app(gallery_root=str(temp_gallery), db_path=db_path, start_cleanup=True)
+
+        assert app.extensions['igallery_cleanup_done'].wait(timeout=10)
+        assert Database(db_path).get_trash_item(orphan) is None
+        assert Database(db_path).get_trash_item(str(kept.resolve())) is not None
+        app.extensions['igallery_cleanup_stop'].set()
+        app.extensions['igallery_cleanup_status']['thread'].join(timeout=10)
+
+    def test_cleanup_repeats_on_interval(self, temp_gallery):
+        """Test that the cleanup thread keeps running passes until stopped."""
+        db_path = str(temp_gallery / "test.db")
+        app = create_app(gallery_root=str(temp_gallery), db_path=db_path,
+                         start_cleanup=True, cleanup_interval=0.05)
+        try:
+            assert app.extensions['igallery_cleanup_done'].wait(timeout=10)
+
+            orphan = str(temp_gallery / "trash" / "later.jpg")
+            Database(db_path).add_to_trash(orphan, str(temp_gallery / "later.jpg"))
+
+            deadline = time.monotonic() + 10
+            while Database(db_path).get_trash_item(orphan) is not None:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+        finally:
+            app.extensions['igallery_cleanup_stop'].set()
+            # Let an in-flight pass finish before the gallery is deleted
+            app.extensions['igallery_cleanup_status']['thread'].join(timeout=10)
@@ -1,6 +1,8 @@
 """Tests for database and image metadata tracking."""
 
+import sqlite3
 import tempfile
+import threading
 import time
 from pathlib import Path
 import pytest
@@ -24,6 +26,101 @@ class TestDatabase:
         # Should not raise any errors
         assert temp_db.db_path is not None
 
+    def test_connection_pragmas(self, temp_db):
+        """Test that connections use WAL with relaxed sync and an in-memory temp store."""
+        with temp_db._get_connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+
+    def test_connections_are_pooled_across_threads(self, temp_db):
+        """Test that a connection released by one thread is reused by the next."""
+        seen = []
+
+        def borrow():
+            with temp_db._get_connection() as conn:
+                seen.append(id(conn))
+
+        for _ in range(3):
+            thread = threading.Thread(target=borrow)
+            thread.start()
+            thread.join()
+
+        assert len(set(seen)) == 1
+
+    def test_connection_discarded_after_operational_error(self, temp_db):
+        """Test that a connection which raised OperationalError is not pooled."""
+        with pytest.raises(sqlite3.OperationalError):
+            with temp_db._get_connection() as conn:
+                conn.execute("SELECT * FROM no_such_table")
+
+        assert temp_db._pool.empty()
+        assert temp_db.get_thumbnail("/missing.jpg", 1.0) is None
+
+    def test_transaction_groups_writes(self, temp_db):
+        """Test that writes inside transaction() commit together or not at all."""
+        with temp_db.transaction():
+            temp_db.add_to_trash("/trash/a.jpg", "/a.jpg")
+            temp_db.save_thumbnail("/trash/a.jpg", b"thumb", 1.0, 10)
+
+        assert temp_db.get_trash_item("/trash/a.jpg") is not None
+
+        with pytest.raises(RuntimeError):
+            with temp_db.transaction():
+                temp_db.add_to_trash("/trash/b.jpg", "/b.jpg")
+                temp_db.save_thumbnail("/trash/b.jpg", b"thumb", 1.0, 10)
+                raise RuntimeError("abort")
+
+        assert temp_db.get_trash_item("/trash/b.jpg") is None
+        assert temp_db.get_thumbnail("/trash/b.jpg", 1.0) is None
+
+    def test_schema_version_skips_migrations_on_reopen(self, tmp_path):
+        """Test that an up-to-date database is not migrated again on open."""
+        image = tmp_path / "a.jpg"
+        image.write_bytes(b"x")
+        db_path = str(tmp_path / "versioned.db")
+        db = Database(db_path)
+        with db._get_connection() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == Database.SCHEMA_VERSION
+
+        # A view stamped exactly at the file mtime looks like the legacy
+        # never-viewed marker, which the migration would reset to NULL
+        db.record_views([(str(image), image.stat().st_mtime)])
+        db.close()
+
+        reopened = Database(db_path)
+        with reopened._get_connection() as conn:
+            row = conn.execute(
+                "SELECT last_viewed_at FROM image_metadata WHERE image_path = ?", (str(image),)
+            ).fetchone()
+        assert row['last_viewed_at'] is not None
+
+    def test_missing_table_recreated_at_current_version(self, tmp_path):
+        """Test that a versioned database missing a table is repaired on open."""
+        db_path = str(tmp_path / "versioned.db")
+        db = Database(db_path)
+        with db._get_connection() as conn:
+            conn.execute("DROP TABLE directory_index")
+            conn.commit()
+        db.close()
+
+        reopened = Database(db_path)
+        reopened.update_directory_index([("/g", 1)], [])
+        assert reopened.get_directory_index_entry("/g") == (1, [])
+
+    def test_directory_index_derives_direct_children(self, temp_db):
+        """Test that index lookups only see paths directly in the directory."""
+        temp_db.update_directory_index(
+            [("/g", 5), ("/g/a", 6), ("/g/a/b", 7), ("/g2", 8)], []
+        )
+        temp_db.sync_images(["/g/x.jpg", "/g/a/y.jpg", "/g2/z.jpg"])
+        temp_db.save_thumbnail("/g/t.jpg", b"thumb", 1.0, 10)
+        temp_db.add_to_trash("/g/x.jpg", "/orig/x.jpg")
+
+        assert temp_db.get_directory_index_entry("/g") == (5, ["a"])
+        assert temp_db.get_directory_index_entry("/missing") is None
+        assert sorted(temp_db.get_tracked_paths_in_dir("/g")) == ["/g/t.jpg", "/g/x.jpg"]
+
     def test_save_and_get_thumbnail(self, temp_db):
         """Test saving and retrieving thumbnail records."""
         thumbnail_data = b"fake thumbnail data"
@@ -37,6 +134,30 @@ class TestDatabase:
         retrieved_data = temp_db.get_thumbnail("/path/to/image.jpg", 12345.0)
         assert retrieved_data == thumbnail_data
 
+    def test_legacy_float_mtime_thumbnails_dropped(self, tmp_path):
+        """Test that a thumbnails table keyed on REAL mtimes is rebuilt."""
+        db_path = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE thumbnails (
+                image_path TEXT PRIMARY KEY,
+                thumbnail_data BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                image_mtime REAL NOT NULL,
+                image_size INTEGER NOT NULL
+            )
+        """)
+        conn.execute("INSERT INTO thumbnails VALUES ('/a.jpg', x'00', 1.0, 1.5, 10)")
+        conn.commit()
+        conn.close()
+
+        db = Database(db_path)
+        mtime_ns = 1_700_000_000_123_456_789
+        db.save_thumbnail("/a.jpg", b"thumb", mtime_ns, 10)
+
+        assert db.get_thumbnail("/a.jpg", mtime_ns) == b"thumb"
+        assert db.get_thumbnail("/a.jpg", mtime_ns + 1) is None
+
     def test_thumbnail_invalidated_on_mtime_change(self, temp_db):
         """Test that thumbnail is invalidated when image mtime changes."""
         with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
@@ -96,6 +217,50 @@ class TestDatabase:
         result = temp_db.get_least_recently_viewed(images)
         assert result == images[0]
 
+    def test_least_recently_viewed_large_list(self, temp_db):
+        """Test path lists beyond SQLite's bound-parameter limit."""
+        images = [f"/img{i}.jpg" for i in range(40000)]
+        temp_db.sync_images(images)
+        temp_db.record_views([(p, 100.0) for p in images if p != "/img39999.jpg"])
+
+        assert temp_db.get_least_recently_viewed(images) == "/img39999.jpg"
+        assert temp_db.get_random_image(images) == "/img39999.jpg"
+
+    def test_random_image_prefers_unviewed(self, temp_db):
+        """Test random selection picks unviewed images until all are viewed."""
+        images = [f"/img{i}.jpg" for i in range(6)]
+        temp_db.sync_images(images)
+        temp_db.record_views([(p, 100.0) for p in images[:4]])
+
+        picks = {temp_db.get_random_image(images) for _ in range(50)}
+        assert picks <= set(images[4:])
+
+        temp_db.record_views([(p, 200.0) for p in images[4:]])
+        assert temp_db.get_random_image(images) in images
+        assert temp_db.get_random_image([]) is None
+
+    def test_legacy_rowid_tables_rebuilt_without_rowid(self, tmp_path):
+        """Test that rowid metadata and trash tables are migrated with their rows."""
+        db_path = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE image_metadata (image_path TEXT PRIMARY KEY, last_viewed_at REAL, file_created_at REAL)")
+        conn.execute("CREATE TABLE trash (trash_path TEXT PRIMARY KEY, original_path TEXT NOT NULL, trashed_at REAL NOT NULL)")
+        conn.execute("INSERT INTO image_metadata VALUES ('/a.jpg', 5.0, 1.0)")
+        conn.execute("INSERT INTO trash VALUES ('/trash/b.jpg', '/b.jpg', 2.0)")
+        conn.commit()
+        conn.close()
+
+        db = Database(db_path)
+
+        with db._get_connection() as conn:
+            for table in ("image_metadata", "trash"):
+                sql = conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)
+                ).fetchone()[0]
+                assert "WITHOUT ROWID" in sql
+        assert db.get_least_recently_viewed(["/a.jpg"]) == "/a.jpg"
+        assert db.get_trash_item("/trash/b.jpg")['original_path'] == "/b.jpg"
+
     def test_least_recently_viewed_empty_list(self, temp_db):
         """Test least recently viewed with empty list."""
         result = temp_db.get_least_recently_viewed([])
@@ -158,6 +323,22 @@ class TestDatabase:
         assert item['original_path'] == original_path
         assert 'trashed_at' in item
 
+    def test_list_trashed_images_pages_by_keyset(self, temp_db):
+        """Test paging through the trash newest-first with limit/before_ts."""
+        with temp_db._get_connection() as conn:
+            conn.executemany(
+                "INSERT INTO trash (trash_path, original_path, trashed_at) VALUES (?, ?, ?)",
+                [(f"/trash/{i}.jpg", f"/{i}.jpg", float(i)) for i in range(5)]
+            )
+            conn.commit()
+
+        first = temp_db.list_trashed_images(limit=2)
+        assert [item['trash_path'] for item in first] == ["/trash/4.jpg", "/trash/3.jpg"]
+
+        rest = temp_db.list_trashed_images(limit=10, before_ts=first[-1]['trashed_at'])
+        assert [item['trash_path'] for item in rest] == ["/trash/2.jpg", "/trash/1.jpg", "/trash/0.jpg"]
+        assert len(temp_db.list_trashed_images()) == 5
+
     def test_get_trash_item_nonexistent(self, temp_db):
         """Test retrieving nonexistent trash item returns None."""
         item = temp_db.get_trash_item("/nonexistent/path.jpg")
@@ -178,6 +359,53 @@ class TestDatabase:
             assert temp_db.get_thumbnail(p, 100.0) is None
             assert temp_db.get_trash_item(p) is None
 
+    def test_sync_trash_folder_reconstructs_original_paths(self, temp_db, tmp_path):
+        """Test that untracked trash files get records pointing back to their folder."""
+        gallery = tmp_path / "gallery"
+        nested = gallery / "trash" / "vacation"
+        nested.mkdir(parents=True)
+        (gallery / "trash" / "a.jpg").write_bytes(b"x")
+        (nested / "b.png").write_bytes(b"x")
+        (nested / "notes.txt").write_bytes(b"x")
+
+        temp_db.sync_trash_folder(str(gallery / "trash"), str(gallery))
+
+        items = {item['trash_path']: item['original_path'] for item in temp_db.list_trashed_images()}
+        real = gallery.resolve()
+        assert items == {
+            str(real / "trash" / "a.jpg"): str(real / "a.jpg"),
+            str(real / "trash" / "vacation" / "b.png"): str(real / "vacation" / "b.png"),
+        }
+
+    def test_cleanup_orphaned_records(self, temp_db):
+        """Test that only records missing from disk are removed."""
+        for p in ("/g/keep.jpg", "/g/gone.jpg", "/g/trash/t.jpg"):
+            temp_db.save_thumbnail(p, b"thumb", 1.0, 10)
+            temp_db.record_view(p)
+        temp_db.add_to_trash("/g/trash/t.jpg", "/g/t.jpg")
+        temp_db.add_to_trash("/g/trash/gone.jpg", "/g/gone2.jpg")
+
+        counts = temp_db.cleanup_orphaned_records({"/g/keep.jpg"}, {"/g/trash/t.jpg"})
+
+        assert counts == (1, 1, 1)
+        assert temp_db.get_thumbnail("/g/keep.jpg", 1.0) == b"thumb"
+        assert temp_db.get_thumbnail("/g/trash/t.jpg", 1.0) == b"thumb"
+        assert temp_db.get_thumbnail("/g/gone.jpg", 1.0) is None
+        assert [item['trash_path'] for item in temp_db.list_trashed_images()] == ["/g/trash/t.jpg"]
+
+    def test_cleanup_orphaned_records_accepts_overlapping_iterables(self, temp_db):
+        """Test generators work and a path in both sets keeps its trash record."""
+        temp_db.add_to_trash("/g/trash/t.jpg", "/g/t.jpg")
+        temp_db.save_thumbnail("/g/a.jpg", b"thumb", 1.0, 10)
+
+        counts = temp_db.cleanup_orphaned_records(
+            (p for p in ["/g/a.jpg", "/g/trash/t.jpg"]),
+            (p for p in ["/g/trash/t.jpg"])
+        )
+
+        assert counts == (0, 0, 0)
+        assert temp_db.get_trash_item("/g/trash/t.jpg") is not None
+
     def test_bulk_delete_trash_empty(self, temp_db):
         """Test bulk delete with empty list is a no-op."""
         temp_db.bulk_delete_trash([])
@@ -196,3 +424,100 @@ class TestDatabase:
         result = temp_db.get_least_recently_viewed(images)
         # img2 was never viewed, so it should still be returned
         assert result == images[1]
+
+    def test_sync_images_only_stats_new_paths(self, temp_db, tmp_path, monkeypatch):
+        """Test that already-tracked images are not stat'ed again on resync."""
+        images = []
+        for name in ("a.jpg", "b.jpg"):
+            path = tmp_path / name
+            path.write_bytes(b"x")
+            images.append(str(path))
+        temp_db.sync_images(images[:1])
+
+        import igallery.database as database_module
+        real_stat = database_module.os.stat
+        stat_calls = []
+
+        def counting_stat(path, *args, **kwargs):
+            stat_calls.append(str(path))
+            return real_stat(path, *args, **kwargs)
+
+        monkeypatch.setattr(database_module.os, "stat", counting_stat)
+        temp_db.sync_images(images)
+        monkeypatch.undo()
+
+        assert stat_calls == [images[1]]
+        with temp_db._get_connection() as conn:
+            row = conn.execute(
+                "SELECT file_created_at FROM image_metadata WHERE image_path = ?",
+                (images[1],)
+            ).fetchone()
+        assert row['file_created_at'] == Path(images[1]).stat().st_mtime
+
+    def test_record_views_batch(self, temp_db):
+        """Test that batched views keep their queued timestamps."""
+        images = ["/img1.jpg", "/img2.jpg", "/img3.jpg"]
+        temp_db.sync_images(images)
+
+        temp_db.record_views([(images[2], 100.0), (images[0], 200.0), (images[1], 300.0)])
+
+        assert temp_db.get_least_recently_viewed(images) == images[2]
+
+    def test_record_views_never_moves_a_view_back(self, temp_db):
+        """Test that a late batch with an older view keeps the newer one."""
+        images = ["/img1.jpg", "/img2.jpg"]
+        temp_db.sync_images(images)
+
+        temp_db.record_views([(images[0], 300.0), (images[1], 200.0)])
+        temp_db.record_views([(images[0], 100.0)])
+
+        assert temp_db.get_least_recently_viewed(images) == images[1]
+
+    def test_least_recently_viewed_under_directory(self, temp_db):
+        """Test prefix-scoped selection skips other dirs and stale records."""
+        on_disk = {"/gallery/a.jpg", "/gallery/sub/b.jpg"}
+        temp_db.sync_images(["/gallery/a.jpg", "/gallery/sub/b.jpg",
+                             "/gallery/gone.jpg", "/gallery2/c.jpg"])
+        temp_db.record_views([("/gallery/a.jpg", 100.0)])
+
+        # gone.jpg and gallery2 are unviewed but must not be picked
+        assert temp_db.get_least_recently_viewed_under("/gallery", on_disk) == "/gallery/sub/b.jpg"
+
+        temp_db.record_views([("/gallery/sub/b.jpg", 200.0)])
+        assert temp_db.get_least_recently_viewed_under("/gallery", on_disk) == "/gallery/a.jpg"
+        assert temp_db.get_least_recently_viewed_under("/gallery/sub", on_disk) == "/gallery/sub/b.jpg"
+        assert temp_db.get_least_recently_viewed_under("/other", on_disk) is None
+
+    def test_least_recently_viewed_under_matches_unscoped_order(self, temp_db):
+        """Test that both methods rank NULL creation times and views alike."""
+        images = [f"/gallery/img{i}.jpg" for i in range(4)]
+        temp_db.sync_images(images)
+        with temp_db._get_connection() as conn:
+            conn.executemany(
+                "UPDATE image_metadata SET file_created_at = ? WHERE image_path = ?",
+                [(5.0, images[0]), (None, images[1]), (-1.0, images[2]), (1.0, images[3])]
+            )
+            conn.commit()
+
+        for viewed_at in (100.0, 200.0, 300.0, 400.0):
+            expected = temp_db.get_least_recently_viewed(images)
+            assert temp_db.get_least_recently_viewed_under("/gallery", set(images)) == expected
+            temp_db.record_views([(expected, viewed_at)])
+        assert temp_db.get_least_recently_viewed_under("/gallery", set(images)) == images[1]
+
+    def test_least_recently_viewed_under_searches_prefix_range(self, temp_db):
+        """Test that only the directory's primary key range is ranked."""
+        with temp_db._get_connection() as conn:
+            plan = conn.execute(
+                """
+                EXPLAIN QUERY PLAN
+                SELECT image_path FROM image_metadata
+                WHERE image_path >= ? AND image_path < ?
+                ORDER BY last_viewed_at IS NOT NULL, last_viewed_at ASC,
+                    file_created_at ASC
+                """,
+                ("/gallery/", "/gallery0")
+            ).fetchall()
+        assert any(
+            row[3].startswith("SEARCH image_metadata USING PRIMARY KEY") for row in plan
+        )
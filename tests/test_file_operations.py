@@ -1,11 +1,13 @@
 """Tests for file operations (navigation, trash)."""
 
+import errno
+import os
 import tempfile
 from pathlib import Path
 import pytest
 from PIL import Image
 
-from igallery.file_operations import FileOperations
+from igallery.file_operations import FileOperations, _cached_scan, move_file
 
 
 @pytest.fixture
@@ -216,3 +218,68 @@ class TestFileOperations:
         """Test that relative paths are handled correctly."""
         subdirs = file_ops.list_subdirectories()
         assert all(not Path(d).is_absolute() for d in subdirs)
+
+    def test_page_with_directories_previews(self, file_ops, temp_gallery):
+        """Test directories come first with preview info, then images."""
+        (temp_gallery / "subdir1" / "nested").mkdir()
+        (temp_gallery / "odd.jpg").mkdir()  # Directory with an image-like name
+
+        items, total_pages = file_ops.get_page_with_directories(1, 5)
+
+        assert total_pages == 4
+        assert [item['name'] for item in items[:3]] == ["odd.jpg", "subdir1", "subdir2"]
+        assert items[1]['first_image'] == "sub_image0.jpg"
+        assert items[1]['item_count'] == 6
+        assert items[2]['first_image'] is None and items[2]['item_count'] == 0
+        assert items[3] == {
+            'type': 'image',
+            'name': 'image00.jpg',
+            'path': str(temp_gallery.resolve() / "image00.jpg"),
+        }
+
+    def test_listing_cached_until_directory_changes(self, temp_gallery):
+        """Test that listings are reused until the directory's mtime moves."""
+        subdir = temp_gallery / "subdir1"
+        os.utime(subdir, ns=(1_000_000_000, 1_000_000_000))
+        file_ops = FileOperations(str(subdir), gallery_root=str(temp_gallery))
+
+        first = file_ops.list_images()
+        hits = _cached_scan.cache_info().hits
+        assert file_ops.list_images() == first
+        assert _cached_scan.cache_info().hits == hits + 1
+
+        Image.new('RGB', (10, 10)).save(subdir / "sub_image9.jpg", 'JPEG')
+        os.utime(subdir, ns=(2_000_000_000, 2_000_000_000))
+        assert len(file_ops.list_images()) == len(first) + 1
+
+    def test_recently_modified_directory_not_cached(self, file_ops, temp_gallery):
+        """Test that a directory changed within the racy window is rescanned."""
+        before = len(file_ops.list_images())
+        Image.new('RGB', (10, 10)).save(temp_gallery / "image99.jpg", 'JPEG')
+        assert len(file_ops.list_images()) == before + 1
+
+    def test_page_with_directories_later_pages(self, file_ops):
+        """Test pages past the directories hold only the right images."""
+        items, total_pages = file_ops.get_page_with_directories(2, 5)
+        assert total_pages == 4
+        assert [item['name'] for item in items] == [f"image{i:02d}.jpg" for i in range(3, 8)]
+
+        items, _ = file_ops.get_page_with_directories(4, 5)
+        assert [item['name'] for item in items] == ["image13.jpg", "image14.jpg"]
+
+
+class TestMoveFile:
+    """Test the rename-first file move helper."""
+
+    def test_falls_back_to_copy_across_filesystems(self, temp_gallery, monkeypatch):
+        """Test that EXDEV from rename falls back to a copying move."""
+        def cross_device_rename(src, dst):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        src = temp_gallery / "image00.jpg"
+        dst = temp_gallery / "subdir1" / "moved.jpg"
+        monkeypatch.setattr(os, "rename", cross_device_rename)
+        move_file(str(src), str(dst))
+
+        assert dst.exists()
+        assert not src.exists()
@@ -44,6 +44,18 @@ class TestThumbnailService:
         assert isinstance(thumbnail_data, bytes)
         assert len(thumbnail_data) > 0
 
+    def test_thumbnail_reuses_caller_stat(self, thumbnail_service, test_image):
+        """Test that a stat result passed in is used as the cache key."""
+        stat_result = os.stat(test_image)
+        thumbnail_data = thumbnail_service.get_or_create_thumbnail(
+            test_image, stat_result=stat_result
+        )
+
+        cached = thumbnail_service.db.get_thumbnail(
+            str(Path(test_image).resolve()), stat_result.st_mtime_ns
+        )
+        assert cached == thumbnail_data
+
     def test_thumbnail_dimensions(self, thumbnail_service, test_image):
         """Test that thumbnail has correct dimensions."""
         thumbnail_data = thumbnail_service.get_or_create_thumbnail(
@@ -165,3 +177,11 @@ class TestThumbnailService:
         with Image.open(BytesIO(cached_data)) as img:
             assert img.format == 'JPEG'
             assert img.size[0] > 0
+
+    def test_is_image_file_extensions(self):
+        """Test extension matching on names and full paths."""
+        assert ThumbnailService.is_image_file("/photos/a.JPG")
+        assert ThumbnailService.is_image_file("b.webp")
+        assert not ThumbnailService.is_image_file("/photos/notes.txt")
+        assert not ThumbnailService.is_image_file("/photos/.jpg")
+        assert not ThumbnailService.is_image_file("/photos.jpg/readme")